@@ -2,23 +2,49 @@ from customtkinter import *
 import tkinter as tk
 from tkinter import filedialog, messagebox
 from pathlib import Path
-import subprocess
 import threading
+import io
 import os
-import sys
 import platform
+from contextlib import redirect_stdout
 from datetime import datetime
 from typing import Optional
 
-# 可選：首次使用時提示下載模型
-try:
-    from huggingface_hub import snapshot_download
-    HF_AVAILABLE = True
-except Exception:
-    HF_AVAILABLE = False
+
+class GUIWriter(io.StringIO):
+    """將 stdout 逐行轉送到 GUI 的寫入器"""
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        # 當遇到換行時，輸出整行
+        if '\n' in self.buffer:
+            lines = self.buffer.split('\n')
+            for line in lines[:-1]:
+                if line.strip():
+                    self.callback(line + '\n')
+            self.buffer = lines[-1]
+        return len(text)
+
+    def flush(self):
+        if self.buffer.strip():
+            self.callback(self.buffer + '\n')
+            self.buffer = ""
 
 
 class AudioConverterApp:
+    PROFILE_CHUNKS = 2  # 開啟效能分析時，分析的段落數（自第 1 段起）
+    # 語言選單：顯示名稱 → 語言代碼（None 表示整個檔案自動偵測一次）
+    LANGUAGE_OPTIONS = {
+        "自動偵測": None,
+        "中文": "zh",
+        "English": "en",
+        "日本語": "ja",
+    }
+
     def __init__(self):
         self.app = CTk()
         self.app.geometry("700x600")
@@ -29,13 +55,14 @@ class AudioConverterApp:
         self.selected_file_path = None
         self.is_converting = False
         self.conversion_thread = None
-        self.current_process = None
-        # 決定編碼方式（使用系統預設編碼，避免跨平台問題）
-        # 在 Windows 打包環境中 sys.stdout 可能是 None
-        self.encoding = getattr(sys.stdout, 'encoding', None) or 'utf-8'
+        # 常駐轉錄引擎（視窗開啟即於背景預載模型，跨多次轉換重用）
+        self.engine = None
+        self.engine_thread = None
+        self.cancel_event = threading.Event()
         
         self.setup_window()
         self.create_widgets()
+        self._start_engine_warmup()
         
         # 設定視窗關閉時的處理
         self.app.protocol("WM_DELETE_WINDOW", self.on_closing)
@@ -104,6 +131,30 @@ class AudioConverterApp:
             width=120
         )
         self.cancel_btn.pack(side="left", padx=10)
+
+        # 轉換選項：語言（預設整個檔案自動偵測一次）與效能分析開關
+        options_frame = CTkFrame(main_container, fg_color="transparent")
+        options_frame.pack(pady=(0, 10))
+
+        CTkLabel(options_frame, text="語言：", font=("微軟正黑體", 11)).pack(side="left")
+        self.language_var = tk.StringVar(value=next(iter(self.LANGUAGE_OPTIONS)))
+        self.language_menu = CTkOptionMenu(
+            options_frame,
+            values=list(self.LANGUAGE_OPTIONS),
+            variable=self.language_var,
+            width=120
+        )
+        self.language_menu.pack(side="left", padx=(0, 20))
+
+        # 效能分析：對前幾段輸出 Chrome trace 與 cProfile 統計（與逐字稿同資料夾）
+        self.profile_var = tk.BooleanVar(value=False)
+        self.profile_checkbox = CTkCheckBox(
+            options_frame,
+            text=f"效能分析（前 {self.PROFILE_CHUNKS} 段）",
+            variable=self.profile_var,
+            font=("微軟正黑體", 11)
+        )
+        self.profile_checkbox.pack(side="left")
         
         # 狀態標籤
         self.status_label = CTkLabel(
@@ -157,6 +208,8 @@ class AudioConverterApp:
             state="disabled"
         )
         self.output_text.pack(side="left", fill="both", expand=True)
+        # 串流中的部分文字（段落完成後以最終文字取代）
+        self.output_text.tag_configure("partial", foreground="#999999")
         
         # 正確綁定滾動條
         scrollbar = tk.Scrollbar(output_frame, command=self.output_text.yview)
@@ -230,13 +283,18 @@ class AudioConverterApp:
         
         
         self.is_converting = True
+        self.cancel_event.clear()
         self.update_button_states(uploading=False, converting=False, canceling=True)
         self.update_status("⏳ 轉換中...")
         self.clear_output()
         self.append_output(f"開始轉換...\n檔案: {Path(self.selected_file_path).name}\n時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n系統: {platform.system()}\n\n")
         
+        # Tk 變數只能在主執行緒讀取，先取值再交給背景執行緒
+        language = self.LANGUAGE_OPTIONS.get(self.language_var.get())
+        profile = self.profile_var.get()
+
         # 在背景執行（非 daemon 以確保應用關閉時執行緒能正確終止）
-        self.conversion_thread = threading.Thread(target=self._run_conversion, daemon=False)
+        self.conversion_thread = threading.Thread(target=self._run_conversion, args=(language, profile), daemon=False)
         self.conversion_thread.start()
     
     def _get_desktop_path(self):
@@ -282,8 +340,9 @@ class AudioConverterApp:
         default_path.mkdir(parents=True, exist_ok=True)
         return default_path
     
-    def _run_conversion(self):
-        """在背景線程執行轉換腳本"""
+    def _run_conversion(self, language, profile):
+        """在背景線程以常駐引擎執行轉換"""
+        transcribe_module = None
         try:
             # 生成輸出檔案路徑（放在使用者的桌面）
             input_path = Path(self.selected_file_path)
@@ -301,153 +360,93 @@ class AudioConverterApp:
                 except Exception as e:
                     self.app.after(0, self.append_output, f"⚠ 無法刪除舊檔案: {str(e)}\n\n")
 
-            # 首次下載處理：
-            # - Windows：不主動觸發 snapshot_download，僅顯示提示，交由 transformers 自行處理（避免卡住問題）
-            # - 其他平台（macOS/Linux）：使用 snapshot_download 篩除訓練檔案，縮短與精簡下載
-            if platform.system() == "Windows":
-                self._show_model_download_ui("⬇️ 首次使用可能需下載模型（~3GB 推論檔案），請保持應用開啟，過程可能需要數分鐘…")
-            else:
-                # 非 Windows 平台採用預先抓取以避免額外大檔案
-                self._ensure_model_downloaded_with_ui()
+            # 等待背景預載完成（模型已就緒時立即返回）
+            warmup_done = self._wait_engine_warmup()
+            import transcribe as transcribe_module
+            if not warmup_done:
+                raise transcribe_module.TranscriptionCancelled()
+            if self.engine is None:
+                self.engine = transcribe_module.TranscriptionEngine()
+            if not self.engine.is_ready:
+                self.app.after(0, self.append_output, "⏳ 等待模型載入完成…\n")
 
-            # ✅ 打包環境：直接導入 transcribe 模組執行（避免系統 Python 依賴問題）
-            if getattr(sys, 'frozen', False):
-                self.app.after(0, self.append_output, "使用打包環境執行轉錄...\n\n")
-                
-                # 使用內嵌的 transcribe 模組（PyInstaller 已打包所有依賴）
-                try:
-                    import transcribe as transcribe_module
-                    
-                    # 重定向 stdout 來捕捉輸出
-                    import io
-                    from contextlib import redirect_stdout
-                    
-                    class GUIWriter(io.StringIO):
-                        def __init__(self, callback):
-                            super().__init__()
-                            self.callback = callback
-                            self.buffer = ""
-                        
-                        def write(self, text):
-                            self.buffer += text
-                            # 當遇到換行時，輸出整行
-                            if '\n' in self.buffer:
-                                lines = self.buffer.split('\n')
-                                for line in lines[:-1]:
-                                    if line.strip():
-                                        self.callback(line + '\n')
-                                self.buffer = lines[-1]
-                            return len(text)
-                        
-                        def flush(self):
-                            if self.buffer.strip():
-                                self.callback(self.buffer + '\n')
-                                self.buffer = ""
-                    
-                    # 創建輸出捕捉器
-                    output_writer = GUIWriter(lambda msg: self.app.after(0, self.append_output, msg))
-                    
-                    # 執行轉錄（在背景線程中，stdout 已重定向）
-                    with redirect_stdout(output_writer):
-                        transcribe_module.main(
-                            input_audio=str(Path(self.selected_file_path).absolute()),
-                            output_text=str(output_path),
-                            non_interactive=True,
-                            auto_clean_progress=True,
-                            suppress_warnings=True
-                        )
-                    
-                    # 確保剩餘緩衝區內容輸出
-                    output_writer.flush()
-                    return_code = 0
-                    
-                except Exception as e:
-                    import traceback
-                    error_detail = traceback.format_exc()
-                    self.app.after(0, self.append_output, f"\n❌ 轉錄過程發生錯誤:\n{error_detail}\n")
-                    return_code = 1
-            else:
-                # 開發環境：使用 subprocess
-                transcribe_script = Path(__file__).parent / "transcribe.py"
-                
-                if not transcribe_script.exists():
-                    error_msg = f"❌ 找不到轉錄腳本: {transcribe_script}\n"
-                    self.app.after(0, self.append_output, error_msg)
-                    self.app.after(0, self.update_status, "❌ 找不到轉錄腳本")
-                    return
-                
-                command = [
-                    sys.executable,
-                    str(transcribe_script),
-                    str(Path(self.selected_file_path).absolute()),
-                    str(output_path),
-                    "--non-interactive",
-                    "--auto-clean-progress",
-                    "--suppress-warnings"
-                ]
-                
-                self.app.after(0, self.append_output, f"執行命令: {' '.join(command)}\n\n")
+            # 重定向 stdout 來捕捉輸出（打包與開發環境皆於同一程序內執行，模型常駐）
+            output_writer = GUIWriter(lambda msg: self.app.after(0, self.append_output, msg))
+            try:
+                with redirect_stdout(output_writer):
+                    self.engine.transcribe(
+                        str(input_path.absolute()),
+                        str(output_path),
+                        cancel_event=self.cancel_event,
+                        non_interactive=True,
+                        auto_clean_progress=True,
+                        suppress_warnings=True,
+                        language=language,
+                        profile=profile,
+                        profile_chunks=(0, self.PROFILE_CHUNKS - 1),
+                        stream_callback=self._on_stream
+                    )
+            finally:
+                # 確保剩餘緩衝區內容輸出
+                output_writer.flush()
 
-                # 強制 Python 不使用緩衝
-                env = os.environ.copy()
-                env['PYTHONUNBUFFERED'] = '1'
-                
-                # 合併 stderr 到 stdout，使用阻塞式讀取（在背景執行緒中不影響 GUI）
-                self.current_process = subprocess.Popen(
-                    command,
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.STDOUT,
-                    text=True,
-                    bufsize=1,  # 行緩衝
-                    encoding=self.encoding,
-                    errors='replace',
-                    env=env
-                )
-                
-                # 直接在背景執行緒中逐行讀取（阻塞式，但不影響 GUI）
-                try:
-                    for line in iter(self.current_process.stdout.readline, ''):
-                        if line:
-                            # 使用 after() 安全地更新 GUI
-                            self.app.after(0, self.append_output, line)
-                except Exception as e:
-                    self.app.after(0, self.append_output, f"\n⚠ 讀取輸出時發生錯誤: {str(e)}\n")
-                finally:
-                    # 確保關閉 stdout
-                    try:
-                        self.current_process.stdout.close()
-                    except Exception:
-                        pass
-                
-                # 等待進程結束
-                return_code = self.current_process.wait()
-            
-            # 顯示完成訊息
-            if return_code == 0:
-                self.app.after(0, self.append_output, f"\n✓ 轉換完成！\n輸出檔案: {output_path}\n")
-                self.app.after(0, self.update_status, "✓ 轉換完成")
-            else:
-                self.app.after(0, self.append_output, f"\n✗ 轉換失敗（錯誤代碼: {return_code}）\n")
-                self.app.after(0, self.update_status, f"✗ 轉換失敗（代碼: {return_code}）")
+            self.app.after(0, self.append_output, f"\n✓ 轉換完成！\n輸出檔案: {output_path}\n")
+            self.app.after(0, self.update_status, "✓ 轉換完成")
         
-        except FileNotFoundError as e:
-            self.app.after(0, self.append_output, f"\n❌ 錯誤: 找不到檔案或 Python\n詳情: {str(e)}\n")
-            self.app.after(0, self.update_status, "❌ 找不到檔案")
         except Exception as e:
-            import traceback
-            error_detail = traceback.format_exc()
-            self.app.after(0, self.append_output, f"\n❌ 錯誤: {str(e)}\n{error_detail}\n")
-            self.app.after(0, self.update_status, "❌ 發生錯誤")
+            cancelled = transcribe_module is not None and isinstance(e, transcribe_module.TranscriptionCancelled)
+            if cancelled or self.cancel_event.is_set():
+                self.app.after(0, self.append_output, "\n⛔ 轉換已被使用者取消（已完成段落已保存，重新轉換同一檔案即可續跑）\n")
+                self.app.after(0, self.update_status, "⛔ 已取消")
+            else:
+                import traceback
+                error_detail = traceback.format_exc()
+                self.app.after(0, self.append_output, f"\n❌ 轉錄過程發生錯誤: {str(e)}\n{error_detail}\n")
+                self.app.after(0, self.update_status, "❌ 發生錯誤")
         
         finally:
-            # 只在非正常終止時才重新啟用按鈕
-            if self.is_converting:
-                self.is_converting = False
-                self.current_process = None
-                self.app.after(0, self.update_button_states, True, True, False)
+            self.is_converting = False
+            self.app.after(0, self.update_button_states, True, True, False)
             # 保險起見，無論成功或失敗都隱藏模型下載提示
             self._hide_model_download_ui()
 
+    # ===== 常駐引擎預載 =====
+    def _start_engine_warmup(self):
+        """視窗開啟後立即於背景下載（如需要）並載入模型"""
+        self.engine_thread = threading.Thread(target=self._warmup_engine, daemon=True)
+        self.engine_thread.start()
+
+    def _warmup_engine(self):
+        self.app.after(0, self.update_status, "⏳ 模型預載中…")
+        try:
+            import transcribe as transcribe_module
+            # 本機已有模型時不連網、直接載入；只有首次（或檔案缺漏）才顯示下載提示
+            if transcribe_module.find_local_model() is None:
+                self._show_model_download_ui("⬇️ 首次使用需下載模型（~3GB 推論檔案），請保持應用開啟，過程可能需要數分鐘…")
+                self.app.after(0, self.append_output, "開始下載 Breeze-ASR-25 模型檔至快取（僅推論檔案）…\n")
+            self.engine = transcribe_module.TranscriptionEngine()
+            self.engine.load()
+            self.app.after(0, self._on_engine_ready, "✓ 模型已就緒")
+        except Exception as e:
+            # 預載失敗不影響使用：開始轉換時會再同步載入並顯示錯誤
+            self.app.after(0, self._on_engine_ready, f"⚠ 模型預載失敗：{e}")
+        finally:
+            self._hide_model_download_ui()
+
+    def _on_engine_ready(self, message):
+        if not self.is_converting:
+            self.update_status(message)
+
+    def _wait_engine_warmup(self, poll_seconds=0.2):
+        """等待預載執行緒結束；期間若使用者取消則回傳 False"""
+        if self.engine_thread is None:
+            return True
+        while self.engine_thread.is_alive():
+            self.engine_thread.join(poll_seconds)
+            if self.cancel_event.is_set():
+                return False
+        return True
+
     # ===== 模型下載提示相關 =====
     def _show_model_download_ui(self, message: str):
         """顯示模型下載提示與不定進度條"""
@@ -471,46 +470,6 @@ class AudioConverterApp:
             self.model_frame.pack_forget()
         self.app.after(0, _hide)
 
-    def _ensure_model_downloaded_with_ui(self):
-        """若本機快取未有模型，顯示提示並進行下載。"""
-        if not HF_AVAILABLE:
-            # 無 huggingface_hub，可跳過（由 transformers 自行處理下載）
-            self.app.after(0, self.append_output, "ⓘ 無法偵測 huggingface_hub，將直接載入模型，首次可能較久…\n")
-            return
-
-        REPO_ID = "MediaTek-Research/Breeze-ASR-25"
-        
-        # 排除訓練檢查點，只下載推論需要的檔案（避免下載 15GB 訓練檔案）
-        INFERENCE_IGNORE_PATTERNS = [
-            "*.bin",              # 排除 optimizer.bin, scheduler.bin, trainer_state.bin 等
-            "*.pkl",              # 排除 random_states_*.pkl 等訓練狀態
-            "checkpoint-*",       # 排除中間檢查點資料夾
-            "*.ckpt",             # 排除 PyTorch Lightning 檢查點
-            "*.pth",              # 排除其他 PyTorch 檢查點
-            "*.pt",               # 排除 PyTorch 權重檔（whisper-github/*.pt 等）
-            "whisper-github/*",   # 排除 whisper-github 子資料夾（含舊格式權重 8.6GB）
-        ]
-
-        # 先檢查是否已存在（純本機檢查，不觸發下載）
-        try:
-            snapshot_download(REPO_ID, local_files_only=True, ignore_patterns=INFERENCE_IGNORE_PATTERNS)
-            return  # 已下載，直接返回
-        except Exception:
-            pass
-
-        # 顯示提示並下載
-        self._show_model_download_ui("⬇️ 首次使用需下載模型（~3GB 推論檔案），請保持應用開啟，過程可能需要數分鐘…")
-        self.app.after(0, self.append_output, "開始下載 Breeze-ASR-25 模型檔至快取（僅推論檔案）…\n")
-        try:
-            # 使用預設進度（tqdm 列印到 stdout），此處提供不定進度條即可
-            # 加上 ignore_patterns 避免下載訓練用的大檔案（optimizer.bin 等）
-            snapshot_download(REPO_ID, ignore_patterns=INFERENCE_IGNORE_PATTERNS)
-            self.app.after(0, self.append_output, "✓ 模型下載完成，繼續轉錄…\n\n")
-        except Exception as e:
-            self.app.after(0, self.append_output, f"⚠ 模型下載時發生例外：{e}\n將嘗試由 transformers 自動處理（可能較久）\n")
-        finally:
-            self._hide_model_download_ui()
-    
     def _validate_file(self, file_path):
         """驗證檔案是否存在且可讀"""
         if not os.path.exists(file_path):
@@ -559,9 +518,37 @@ class AudioConverterApp:
         except Exception:
             pass
     
+    def _on_stream(self, idx, text, final):
+        """串流回呼（於轉換執行緒呼叫）：轉交主執行緒更新輸出區域"""
+        if final:
+            self.app.after(0, self._commit_partial, text)
+        elif text is not None:
+            self.app.after(0, self._show_partial, text)
+
+    def _clear_partial(self):
+        ranges = self.output_text.tag_ranges("partial")
+        # 由後往前刪除，避免索引位移
+        for i in range(len(ranges) - 2, -1, -2):
+            self.output_text.delete(ranges[i], ranges[i + 1])
+
+    def _show_partial(self, text):
+        """顯示目前段落的部分文字（取代前一次的部分文字）"""
+        self.output_text.configure(state="normal")
+        self._clear_partial()
+        self.output_text.insert("end", f"⋯ {text}\n", "partial")
+        self.output_text.see("end")
+        self.output_text.configure(state="disabled")
+
+    def _commit_partial(self, text):
+        """段落完成：移除部分文字，改顯示去除重疊後的最終文字"""
+        self.output_text.configure(state="normal")
+        self._clear_partial()
+        self.output_text.configure(state="disabled")
+        self.append_output(f"📝 {text}\n")
+
     def cancel_conversion(self):
-        """取消正在進行的轉換"""
-        if not self.is_converting or not self.current_process:
+        """取消正在進行的轉換（中斷目前段落的 generate，已完成段落保留於進度檔）"""
+        if not self.is_converting:
             messagebox.showwarning("警告", "目前沒有正在進行的轉換")
             return
         
@@ -570,21 +557,12 @@ class AudioConverterApp:
             "確定要取消目前的轉換嗎？"
         )
         
-        if result:
-            try:
-                self.current_process.terminate()  # 先嘗試溫和終止
-                self.current_process.wait(timeout=2)  # 等待 2 秒
-            except subprocess.TimeoutExpired:
-                # 如果溫和終止失敗，強制殺死
-                self.current_process.kill()
-                self.current_process.wait()
-            
-            self.append_output("\n⛔ 轉換已被使用者取消\n")
-            self.update_status("⛔ 已取消")
-            self.is_converting = False
-            self.current_process = None
-            # 取消後允許再次轉換：啟用上傳與開始轉換，停用取消
-            self.update_button_states(True, True, False)
+        if result and self.is_converting:
+            self.cancel_event.set()
+            self.append_output("\n⏳ 正在取消，目前段落中斷後即停止…\n")
+            self.update_status("⏳ 取消中…")
+            # 等待背景執行緒結束後再重新啟用按鈕（見 _run_conversion 的 finally）
+            self.update_button_states(uploading=False, converting=False, canceling=False)
     
     def on_closing(self):
         """應用關閉時的處理"""
@@ -596,18 +574,11 @@ class AudioConverterApp:
             if not result:
                 return
             
-            # 終止正在執行的程序
-            if self.current_process:
-                try:
-                    self.current_process.terminate()
-                    self.current_process.wait(timeout=2)
-                except subprocess.TimeoutExpired:
-                    self.current_process.kill()
-                    self.current_process.wait()
+            # 通知轉換執行緒停止（generate 於下一個 token 即中斷）
+            self.cancel_event.set()
         
         # daemon=False 的執行緒會在主程式關閉前自動等待完成
         self.app.destroy()
 
-
 if __name__ == "__main__":
     AudioConverterApp()
\ No newline at end of file
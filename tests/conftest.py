@@ -0,0 +1,136 @@
+"""
+測試用的模型與處理器（不需下載）：
+- stub：依固定腳本生成 token 的假模型，驗證停止條件、logits processor、streamer 的串接
+- tiny_whisper：隨機初始化的迷你 WhisperForConditionalGeneration 與真正的 WhisperProcessor，
+  走完整的 HF generate（語言偵測、forced_decoder_ids、encoder_outputs 等限制與正式模型相同）
+"""
+import json
+import types
+
+import pytest
+import torch
+from transformers import (
+    GenerationConfig,
+    WhisperConfig,
+    WhisperFeatureExtractor,
+    WhisperForConditionalGeneration,
+    WhisperProcessor,
+    WhisperTokenizer,
+)
+from transformers.modeling_outputs import BaseModelOutput
+
+import transcribe
+
+SPECIAL_TOKENS = [
+    "<|endoftext|>", "<|startoftranscript|>", "<|en|>", "<|zh|>", "<|translate|>", "<|transcribe|>",
+    "<|startoflm|>", "<|startofprev|>", "<|nocaptions|>", "<|notimestamps|>",
+] + [f"<|{i * 0.02:.2f}|>" for i in range(1501)]  # 時間戳 token（<|notimestamps|> 之後，與正式詞表相同）
+
+
+class StubTokenizer:
+    eos_token_id = 2
+    all_special_ids = [0, 1, 2]
+
+    def decode(self, token_ids, skip_special_tokens=True):
+        token_ids = token_ids.tolist() if hasattr(token_ids, "tolist") else token_ids
+        return " ".join(f"w{t}" for t in token_ids if not (skip_special_tokens and t in self.all_special_ids))
+
+
+class StubProcessor:
+    """不計算 log-mel，只回傳固定形狀的特徵。"""
+    def __init__(self):
+        self.tokenizer = StubTokenizer()
+
+    def __call__(self, arrs, sampling_rate=transcribe.SR, return_tensors="pt", padding=True):
+        return {"input_features": torch.zeros(len(arrs), 4, 8)}
+
+    def batch_decode(self, sequences, skip_special_tokens=True):
+        return [self.tokenizer.decode(row, skip_special_tokens=skip_special_tokens) for row in sequences]
+
+
+class StubModel:
+    """
+    每列依序生成 SCRIPT 中的 token，並照 generate 的介面呼叫
+    logits processor、停止條件、streamer；beam search 時回傳含 sequences_scores 的輸出。
+    """
+    SCRIPT = (5, 6, 7, 2)
+    VOCAB = 16
+    dtype = torch.float32
+    config = types.SimpleNamespace(max_target_positions=32)
+
+    def get_encoder(self):
+        return lambda features: BaseModelOutput(last_hidden_state=torch.randn(features.shape[0], 3, 4))
+
+    def generate(self, input_features=None, max_new_tokens=8, logits_processor=None, stopping_criteria=None, streamer=None,
+                 num_beams=1, return_dict_in_generate=False, encoder_outputs=None, **kwargs):
+        batch = (input_features if input_features is not None else encoder_outputs.last_hidden_state).shape[0]
+        sequences = torch.ones(batch, 1, dtype=torch.long)  # decoder prompt
+        if streamer is not None:
+            streamer.put(sequences)
+        for token in self.SCRIPT[:max_new_tokens]:
+            scores = torch.zeros(batch, self.VOCAB)
+            scores[:, token] = 5.0
+            if logits_processor is not None:
+                scores = logits_processor(sequences, scores)
+            next_tokens = scores.argmax(dim=-1)
+            sequences = torch.cat([sequences, next_tokens[:, None]], dim=1)
+            if streamer is not None:
+                streamer.put(next_tokens)
+            if stopping_criteria is not None and bool(stopping_criteria(sequences, scores).all()):
+                break
+        if streamer is not None:
+            streamer.end()
+        if return_dict_in_generate:
+            return types.SimpleNamespace(sequences=sequences, sequences_scores=torch.full((batch,), -0.1))
+        return sequences
+
+
+def _bytes_to_unicode():
+    """GPT-2 / Whisper byte-level BPE 的位元組 → 字元對照表。"""
+    bs = list(range(ord("!"), ord("~") + 1)) + list(range(ord("¡"), ord("¬") + 1)) + list(range(ord("®"), ord("ÿ") + 1))
+    cs = bs[:]
+    n = 0
+    for b in range(256):
+        if b not in bs:
+            bs.append(b)
+            cs.append(256 + n)
+            n += 1
+    return dict(zip(bs, map(chr, cs)))
+
+
+@pytest.fixture
+def stub():
+    return StubProcessor(), StubModel(), torch.device("cpu")
+
+
+@pytest.fixture(scope="session")
+def tiny_whisper(tmp_path_factory):
+    """(processor, model, device)：只有單一位元組 token 的 byte-level 詞表，模型權重固定種子隨機初始化。"""
+    vocab_dir = tmp_path_factory.mktemp("tiny-whisper")
+    vocab = {c: i for i, c in enumerate(_bytes_to_unicode().values())}
+    (vocab_dir / "vocab.json").write_text(json.dumps(vocab), encoding="utf-8")
+    (vocab_dir / "merges.txt").write_text("#version: 0.2\n", encoding="utf-8")
+    tokenizer = WhisperTokenizer(str(vocab_dir / "vocab.json"), str(vocab_dir / "merges.txt"))
+    tokenizer.add_special_tokens({"additional_special_tokens": SPECIAL_TOKENS[1:]})
+    ids = {token: tokenizer.convert_tokens_to_ids(token) for token in SPECIAL_TOKENS}
+    processor = WhisperProcessor(feature_extractor=WhisperFeatureExtractor(feature_size=80), tokenizer=tokenizer)
+
+    eos = ids["<|endoftext|>"]
+    config = WhisperConfig(
+        vocab_size=len(tokenizer), num_mel_bins=80, d_model=16,
+        encoder_layers=1, decoder_layers=1, encoder_attention_heads=2, decoder_attention_heads=2,
+        encoder_ffn_dim=32, decoder_ffn_dim=32, max_source_positions=1500, max_target_positions=48,
+        pad_token_id=eos, bos_token_id=eos, eos_token_id=eos, decoder_start_token_id=ids["<|startoftranscript|>"],
+    )
+    torch.manual_seed(0)
+    model = WhisperForConditionalGeneration(config).eval()
+    # 與正式 checkpoint 的 generation_config 相同的欄位（含 forced_decoder_ids，generate 才接受該參數）
+    model.generation_config = GenerationConfig(
+        decoder_start_token_id=ids["<|startoftranscript|>"], eos_token_id=eos, pad_token_id=eos,
+        no_timestamps_token_id=ids["<|notimestamps|>"], is_multilingual=True,
+        lang_to_id={"<|en|>": ids["<|en|>"], "<|zh|>": ids["<|zh|>"]},
+        task_to_id={"translate": ids["<|translate|>"], "transcribe": ids["<|transcribe|>"]},
+        forced_decoder_ids=[[1, None], [2, ids["<|transcribe|>"]]],
+        suppress_tokens=[], begin_suppress_tokens=[eos], max_length=config.max_target_positions,
+    )
+    return processor, model, torch.device("cpu")
@@ -0,0 +1,164 @@
+import threading
+import types
+
+import numpy as np
+import pytest
+import torch
+
+from transcribe import (
+    SR,
+    BatchScheduler,
+    EncoderCache,
+    TokenLogprobRecorder,
+    detect_language,
+    second_pass_decode,
+    transcribe_batch_generate,
+    transcribe_chunk_generate,
+)
+
+STUB_TEXT = "w5 w6 w7"
+
+
+@pytest.fixture
+def segments():
+    rng = np.random.RandomState(0)
+    return [(0.1 * rng.randn(SR)).astype(np.float32), (0.1 * rng.randn(2 * SR)).astype(np.float32)]
+
+
+def _check_infos(infos):
+    for info in infos:
+        assert "truncated" in info
+        assert "compression_ratio" in info
+        assert info.get("avg_logprob") is not None and np.isfinite(info["avg_logprob"])
+
+
+# ---------- 假模型：驗證各解碼路徑的串接 ----------
+
+def test_batch_generate(stub, segments):
+    processor, model, device = stub
+    texts, infos, _ = transcribe_batch_generate(segments, processor, model, device)
+    assert texts == [STUB_TEXT, STUB_TEXT]
+    assert not any(info["truncated"] for info in infos)
+    _check_infos(infos)
+
+
+def test_chunk_generate_streams_partial_text(stub, segments):
+    processor, model, device = stub
+    partials, chunk_info = [], {}
+    text, _, elapsed = transcribe_chunk_generate(segments[0], processor, model, device, chunk_info=chunk_info, on_partial=partials.append)
+    assert text == STUB_TEXT and elapsed is not None
+    assert STUB_TEXT in partials and partials[-1] is None
+    assert "avg_logprob" in chunk_info
+
+
+def test_scheduler(stub, segments):
+    processor, model, device = stub
+    engine = types.SimpleNamespace(processor=processor, model=model, device=device, encoder_cache=None, model_lock=threading.Lock())
+    scheduler = BatchScheduler(engine, batch_size=2, max_wait=0.05).start()
+    try:
+        text, _, _, info = scheduler.transcribe(segments[0], job_id="test")
+    finally:
+        scheduler.close()
+    assert text == STUB_TEXT and "truncated" in info
+
+
+def test_second_pass_only_redecodes_low_confidence(stub, segments):
+    processor, model, device = stub
+    texts, infos = second_pass_decode(segments, processor, model, device, [STUB_TEXT, STUB_TEXT],
+                                      [{"truncated": True}, {"truncated": False, "avg_logprob": -0.1, "compression_ratio": 1.0}])
+    assert infos[0].get("second_pass")
+    assert "second_pass" not in infos[1]
+
+
+def test_encoder_cache_hits_on_redecode(stub, segments, tmp_path):
+    processor, model, device = stub
+    cache = EncoderCache(str(tmp_path), max_mb=1, namespace="test")
+    first, _, _ = transcribe_batch_generate(segments, processor, model, device, encoder_cache=cache)
+    again, _, _ = transcribe_batch_generate(segments, processor, model, device, encoder_cache=cache)
+    assert first == again == [STUB_TEXT, STUB_TEXT]
+    assert (cache.hits, cache.misses) == (2, 2)
+
+
+def test_logprob_recorder_restarts_on_new_generate_call():
+    recorder = TokenLogprobRecorder(eos_token_id=2)
+    scores = torch.zeros(3, 4)
+    recorder(torch.ones(3, 1, dtype=torch.long), scores)
+    recorder(torch.tensor([[1, 3]] * 3), scores)
+    # Whisper 以較小的 batch 重新解碼部分列：新呼叫的 prompt 比上一步短
+    recorder(torch.ones(2, 1, dtype=torch.long), torch.zeros(2, 4))
+    assert recorder.finish(torch.tensor([[1, 3, 2]] * 3)) == [None, None, None]
+
+    recorder(torch.ones(2, 1, dtype=torch.long), scores[:2])
+    assert recorder.finish(torch.tensor([[1, 3], [1, 2]])) == [pytest.approx(np.log(0.25))] * 2
+
+
+# ---------- 迷你 Whisper：走真正的 HF generate ----------
+
+def test_tiny_whisper_batch_with_forced_language(tiny_whisper, segments):
+    processor, model, device = tiny_whisper
+    forced = processor.get_decoder_prompt_ids(language="zh", task="transcribe")
+    texts, infos, elapsed = transcribe_batch_generate(segments, processor, model, device, forced_decoder_ids=forced)
+    assert len(texts) == len(infos) == len(segments) and elapsed >= 0
+    _check_infos(infos)
+
+
+def test_tiny_whisper_batch_detects_language_per_chunk(tiny_whisper, segments):
+    processor, model, device = tiny_whisper
+    texts, infos, _ = transcribe_batch_generate(segments, processor, model, device)
+    assert len(texts) == len(segments)
+    _check_infos(infos)
+
+
+def test_tiny_whisper_chunk_matches_batch(tiny_whisper, segments):
+    processor, model, device = tiny_whisper
+    forced = processor.get_decoder_prompt_ids(language="zh", task="transcribe")
+    batch_texts, _, _ = transcribe_batch_generate(segments, processor, model, device, forced_decoder_ids=forced)
+    partials = []
+    text, _, elapsed = transcribe_chunk_generate(segments[0], processor, model, device, forced_decoder_ids=forced, on_partial=partials.append)
+    # transcribe_chunk_generate 會吞掉例外並回傳 elapsed=None（呼叫端存成 FAILED_CHUNK_TEXT）
+    assert elapsed is not None
+    assert text == batch_texts[0]
+    assert partials and partials[-1] is None
+
+
+def test_tiny_whisper_detect_language(tiny_whisper, segments):
+    processor, model, device = tiny_whisper
+    code, confidence, probs = detect_language(segments, processor, model, device)
+    assert code in ("en", "zh")
+    assert confidence == pytest.approx(probs[code])
+    assert sum(probs.values()) == pytest.approx(1.0, abs=1e-4)
+
+
+@pytest.mark.parametrize("language", [None, "zh"])
+def test_tiny_whisper_encoder_cache(tiny_whisper, segments, tmp_path, language):
+    # 未指定語言時 generate 會先做語言偵測，input_features 與 encoder_outputs 同時傳入會失敗
+    processor, model, device = tiny_whisper
+    forced = processor.get_decoder_prompt_ids(language=language, task="transcribe") if language else None
+    cache = EncoderCache(str(tmp_path), max_mb=1, namespace="test")
+    first, infos, _ = transcribe_batch_generate(segments, processor, model, device, forced_decoder_ids=forced, encoder_cache=cache)
+    again, _, _ = transcribe_batch_generate(segments, processor, model, device, forced_decoder_ids=forced, encoder_cache=cache)
+    assert first == again
+    assert (cache.hits, cache.misses) == (2, 2)
+    _check_infos(infos)
+
+
+def test_tiny_whisper_beam_search_reports_confidence(tiny_whisper, segments):
+    processor, model, device = tiny_whisper
+    forced = processor.get_decoder_prompt_ids(language="zh", task="transcribe")
+    _, infos, _ = transcribe_batch_generate(segments, processor, model, device, forced_decoder_ids=forced,
+                                            generate_overrides={"num_beams": 2})
+    _check_infos(infos)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_tiny_whisper_sampling_reports_confidence(tiny_whisper, segments, seed, capsys):
+    # 隨機權重下取樣常出現成對的時間戳 token；Whisper 若對這些列再呼叫一次 generate，平均 log 機率的累計會對不上列數
+    processor, model, device = tiny_whisper
+    torch.manual_seed(seed)
+    texts, infos = second_pass_decode(segments, processor, model, device, ["x", "x"], [{"truncated": True}, {"truncated": True}])
+    assert "第二階段解碼失敗" not in capsys.readouterr().out
+    assert all(info.get("second_pass") for info in infos)
+    torch.manual_seed(seed)
+    _, infos, _ = transcribe_batch_generate(segments, processor, model, device,
+                                            generate_overrides={"do_sample": True, "temperature": 0.2})
+    _check_infos(infos)
@@ -0,0 +1,103 @@
+import json
+import os
+
+import pytest
+
+import transcribe
+from transcribe import (
+    MODEL_ID,
+    REQUIRED_MODEL_FILES,
+    TranscriptionEngine,
+    find_local_model,
+    load_model_manifest,
+    model_manifest_path,
+    write_model_manifest,
+)
+
+REVISION = "0123456789abcdef0123456789abcdef01234567"
+
+
+def _snapshot_dir(cache_dir):
+    return cache_dir / f"models--{MODEL_ID.replace('/', '--')}" / "snapshots" / REVISION
+
+
+def _populate_cache(cache_dir, write_files=None):
+    """建立 HF 快取目錄結構（refs/main → 快照）；write_files(snapshot) 未指定時寫入最小的推論檔案。"""
+    snapshot = _snapshot_dir(cache_dir)
+    snapshot.mkdir(parents=True)
+    refs = snapshot.parent.parent / "refs"
+    refs.mkdir()
+    (refs / "main").write_text(REVISION)
+    if write_files:
+        write_files(snapshot)
+    else:
+        for name in REQUIRED_MODEL_FILES:
+            (snapshot / name).write_text("{}")
+        (snapshot / "model.safetensors").write_bytes(b"\0" * 16)
+    return str(snapshot)
+
+
+@pytest.fixture
+def app_cache(tmp_path, monkeypatch):
+    """把預設清單位置導向暫存目錄，避免讀寫使用者的 ~/.cache/breeze-asr。"""
+    app_dir = tmp_path / "app"
+    app_dir.mkdir()
+    monkeypatch.setattr(transcribe, "APP_CACHE_DIR", str(app_dir))
+    monkeypatch.setattr(transcribe, "MODEL_MANIFEST_PATH", str(app_dir / "model_manifest.json"))
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    return app_dir
+
+
+def test_manifest_path_is_per_cache_dir(app_cache, tmp_path):
+    assert model_manifest_path() == transcribe.MODEL_MANIFEST_PATH
+    first, second = model_manifest_path(str(tmp_path / "a")), model_manifest_path(str(tmp_path / "b"))
+    assert len({first, second, transcribe.MODEL_MANIFEST_PATH}) == 3
+    assert model_manifest_path(str(tmp_path / "a")) == first
+
+
+def test_find_local_model_in_custom_cache(app_cache, tmp_path):
+    cache_dir = tmp_path / "hf"
+    assert find_local_model(cache_dir=str(cache_dir)) is None
+    snapshot = _populate_cache(cache_dir)
+    assert find_local_model(cache_dir=str(cache_dir)) == snapshot
+    manifest = load_model_manifest(model_manifest_path(str(cache_dir)))
+    assert manifest["path"] == snapshot and manifest["revision"] == REVISION
+    assert not os.path.exists(transcribe.MODEL_MANIFEST_PATH)
+
+
+def test_find_local_model_ignores_default_manifest(app_cache, tmp_path):
+    # 預設清單指向另一份完整模型；指定快取目錄時不應沿用
+    other = _populate_cache(tmp_path / "default-hf")
+    write_model_manifest(other, transcribe.MODEL_MANIFEST_PATH)
+    assert load_model_manifest(transcribe.MODEL_MANIFEST_PATH)["path"] == other
+    cache_dir = tmp_path / "hf"
+    snapshot = _populate_cache(cache_dir)
+    assert find_local_model(cache_dir=str(cache_dir)) == snapshot
+
+
+def test_find_local_model_explicit_manifest_path(app_cache, tmp_path):
+    cache_dir = tmp_path / "hf"
+    snapshot = _populate_cache(cache_dir)
+    manifest_path = tmp_path / "manifest.json"
+    assert find_local_model(cache_dir=str(cache_dir), manifest_path=str(manifest_path)) == snapshot
+    assert json.loads(manifest_path.read_text(encoding="utf-8"))["path"] == snapshot
+    assert not os.path.exists(model_manifest_path(str(cache_dir)))
+
+
+def test_engine_loads_from_custom_cache(app_cache, tmp_path, tiny_whisper):
+    processor, model, _ = tiny_whisper
+
+    def save(snapshot):
+        processor.save_pretrained(str(snapshot))
+        model.save_pretrained(str(snapshot))
+        model.generation_config.save_pretrained(str(snapshot))
+
+    cache_dir = tmp_path / "hf"
+    snapshot = _populate_cache(cache_dir, save)
+    manifest_path = tmp_path / "manifest.json"
+    engine = TranscriptionEngine(device="cpu", model_cache_dir=str(cache_dir), manifest_path=str(manifest_path))
+    engine.load()
+    assert engine.model_path == snapshot
+    assert engine.model_revision == REVISION
+    assert engine.model.config.d_model == model.config.d_model
+    assert load_model_manifest(str(manifest_path))["path"] == snapshot
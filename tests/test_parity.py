@@ -0,0 +1,38 @@
+import types
+
+import numpy as np
+import pytest
+
+import transcribe
+from conftest import StubModel
+
+
+class _ShiftedStubModel(StubModel):
+    SCRIPT = (5, 6, 8, 2)
+
+
+@pytest.fixture
+def fake_engines(monkeypatch, stub):
+    """以 TranscriptionEngine 參數中的 backend / dtype 選擇假模型：onnx 與 fp16 的輸出和基準不同。"""
+    processor, _, device = stub
+
+    def _engine(backend="torch", dtype="fp32", **kwargs):
+        model = _ShiftedStubModel() if backend == "onnx" or dtype == "fp16" else StubModel()
+        return types.SimpleNamespace(load=lambda: None, processor=processor, model=model, device=device)
+
+    monkeypatch.setattr(transcribe, "TranscriptionEngine", _engine)
+    monkeypatch.setattr(transcribe, "load_and_prepare", lambda path, target_sr: (np.zeros(10 * transcribe.SR, dtype=np.float32), target_sr))
+
+
+def test_compare_backends_fails_below_threshold(fake_engines):
+    results = transcribe.compare_backends("in.wav", n_chunks=1)
+    assert results["torch"]["passed"]
+    assert not results["onnx"]["passed"]
+    assert transcribe.compare_backends("in.wav", n_chunks=1, min_similarity=0.5)["onnx"]["passed"]
+
+
+def test_dtype_parity_fails_below_threshold(fake_engines):
+    results = transcribe.check_dtype_parity("in.wav", "fp16", n_chunks=1)
+    assert results["fp32"]["passed"]
+    assert not results["fp16"]["passed"]
+    assert all(r["passed"] for r in transcribe.check_dtype_parity("in.wav", "bf16", n_chunks=1).values())
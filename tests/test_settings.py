@@ -0,0 +1,38 @@
+from transcribe import (
+    PROGRESS_FILE_SUFFIX,
+    JobStore,
+    host_profile_tuning,
+    resumable_segment_settings,
+    save_progress_json,
+)
+
+PROFILE = {"backend": "torch", "dtype": "fp16", "segmentation": "silence", "chunk_seconds": 20.0, "overlap_seconds": 1.0,
+           "batch_size": 8, "threads": 6}
+
+
+def test_resume_keeps_progress_file_segmentation(tmp_path):
+    output_text = str(tmp_path / "out.txt")
+    assert resumable_segment_settings(output_text) is None
+    save_progress_json(output_text + PROGRESS_FILE_SUFFIX, {
+        "chunks": {"0": {"text": "done"}},
+        "meta": {"segmentation": "fixed", "chunk_seconds": 30.0, "overlap_seconds": 3.0, "channels": 1},
+    })
+    assert resumable_segment_settings(output_text) == ("fixed", 30.0, 3.0)
+
+
+def test_resume_keeps_store_job_segmentation(tmp_path):
+    output_text = str(tmp_path / "out.txt")
+    store = JobStore(str(tmp_path / "jobs.db"))
+    assert resumable_segment_settings(output_text, store) is None
+    segment_meta = {"segmentation": "silence", "chunk_seconds": 25.0, "overlap_seconds": 1.0, "channels": 1}
+    store.open_job(output_text, "in.wav", [(0, 16000, 0.0, 1.0)], segment_meta)
+    assert resumable_segment_settings(output_text, store) == ("silence", 25.0, 1.0)
+
+
+def test_profile_tuning_requires_matching_backend_and_dtype():
+    assert host_profile_tuning(PROFILE, "torch", "fp16") == {"batch_size": 8, "threads": 6}
+    assert host_profile_tuning(PROFILE, "torch", "fp32") == {}
+    assert host_profile_tuning(PROFILE, "onnx", "fp16") == {}
+    assert host_profile_tuning({}, "torch", "fp32") == {}
+    # 舊版設定檔沒有記錄後端與精度：視為 torch / fp32
+    assert host_profile_tuning({"batch_size": 4}, "torch", "fp32") == {"batch_size": 4}
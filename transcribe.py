@@ -4,6 +4,7 @@
 # 修正注意力遮罩 (attention_mask) 的 shape 問題
 
 import os
+import sys
 import json
 import shutil
 import math
@@ -20,33 +21,461 @@ import re
 import traceback
 import argparse
 import gc
+import hashlib
+import zlib
+import cProfile
+import pstats
+import difflib
+from contextlib import nullcontext, contextmanager
 from typing import Optional
 import warnings
 import platform
+import threading
+import sqlite3
+from concurrent.futures import Future, ThreadPoolExecutor
+from transformers import StoppingCriteria, StoppingCriteriaList, LogitsProcessor, LogitsProcessorList
+from transformers.generation.streamers import BaseStreamer
+from transformers.modeling_outputs import BaseModelOutput
 
 # ---------- Configurable ----------
 CHUNK_SECONDS = 30        # 每段長度（秒）
 OVERLAP_SECONDS = 3       # 每段重疊（秒）
+SEGMENTATION_MODES = ("fixed", "silence")  # fixed：固定長度切片；silence：切點對齊到低能量處
+SNAP_OVERLAP_SECONDS = 0.5  # silence 模式的重疊（切點已在靜音處，只留少量緩衝）
+SNAP_SEARCH_SECONDS = 3.0   # silence 模式：自目標切點往前搜尋最低能量點的範圍（秒）
+ENERGY_FRAME_SECONDS = 0.02 # 短時能量的 frame 長度（秒）
+ENERGY_SMOOTH_FRAMES = 5    # 能量包絡平滑的 frame 數（避免切在字與字間的極短空隙）
+CHANNEL_SILENCE_RMS = 1e-3  # 聲道分開模式：段落 RMS 低於此值視為該聲道無人說話，不送入模型（避免幻覺文字）
 SR = 16000
 MAX_TIME_WARN = 180
 PROGRESS_FILE_SUFFIX = ".progress.json"
+FAILED_CHUNK_TEXT = "[無法轉錄]"  # 推論失敗段落的佔位文字；續跑時會重新轉錄
+STORE_LEASE_SECONDS = 600   # SQLite 工作庫：段落被領取後超過此秒數未完成，視為該 worker 已中斷，可由其他 worker 重新領取
+MODEL_ID = "MediaTek-Research/Breeze-ASR-25"
+APP_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "breeze-asr")
+ONNX_CACHE_DIR = os.path.join(APP_CACHE_DIR, "onnx")  # ONNX 匯出檔（依模型版本分目錄，每個版本只轉換一次）
+MODEL_MANIFEST_PATH = os.path.join(APP_CACHE_DIR, "model_manifest.json")  # 本機模型檔清單（路徑、大小、SHA-256）
+ENCODER_CACHE_DIR = os.path.join(APP_CACHE_DIR, "encoder")  # encoder 輸出快取（每段一個 fp16 .npy）
+ENCODER_CACHE_MAX_MB = 2048     # encoder 輸出快取大小上限（每段約 3.7MB；超過時淘汰最久未使用的段落）
+# 推論必需的檔案（權重另需至少一個 *.safetensors）
+REQUIRED_MODEL_FILES = ("config.json", "generation_config.json", "preprocessor_config.json", "tokenizer_config.json")
+BACKENDS = ("torch", "onnx")
+PARITY_MIN_SIMILARITY = 0.95  # --compare-backends / --dtype-parity：與基準的文字一致性低於此值時以非零狀態碼結束
+DTYPES = {"fp32": torch.float32, "bf16": torch.bfloat16, "fp16": torch.float16}  # --dtype 可用的權重精度
+# 重複迴圈（幻覺）偵測：尾端同一 n-gram 連續出現即提早停止
+REPEAT_MAX_NGRAM = 10           # 偵測的最長 n-gram（token 數）
+REPEAT_MIN_REPEATS = 4          # 至少連續重複次數
+REPEAT_MIN_SPAN_TOKENS = 16     # 重複區段至少涵蓋的 token 數（避免「哈哈哈」等短重複誤判）
+COMPRESSION_RATIO_THRESHOLD = 2.4  # 與 Whisper 相同的壓縮比門檻
+LOOP_CHECK_MIN_TOKENS = 48      # 生成至少這麼多 token 後才檢查壓縮比
+LOOP_CHECK_EVERY = 8            # 壓縮比每隔幾個 token 檢查一次（需 decode，較昂貴）
+REDECODE_TEMPERATURE = 0.4      # 重新解碼被截斷段落時使用的取樣溫度
+LOGPROB_THRESHOLD = -1.0        # 與 Whisper 相同：段落平均 token log 機率低於此值視為低信心
+SECOND_PASS_BEAMS = 5           # 第二階段：低信心段落先以 beam search 重新解碼
+SECOND_PASS_TEMPERATURES = (0.2, 0.4, 0.6, 0.8)  # 第二階段：beam search 仍未達門檻時依序嘗試的取樣溫度
+BATCH_SIZE = 4                  # 跨檔案動態批次：每次 generate 的目標段落數
+MAX_BATCH_WAIT = 0.5            # 跨檔案動態批次：最久等待湊批的秒數
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".m4a", ".flac", ".ogg")
+# 記憶體管理：依 RSS 與系統可用記憶體決定批次大小與 GC 時機
+GC_RSS_GROWTH_MB = 512          # RSS 自上次 GC 後成長超過此值才執行 GC
+MEMORY_LOW_WATERMARK_GB = 2.0   # 可用記憶體低於此值：縮小批次並執行 GC
+MEMORY_MIN_AVAILABLE_GB = 1.0   # 可用記憶體低於此值（GC 後）：停止並保留進度，避免被 OOM 終止
+MEMORY_PER_CHUNK_GB = 0.75      # 每個批次段落估計額外記憶體（特徵、encoder 輸出、KV cache）
+MEMORY_PER_JOB_GB = 0.25        # 每個同時進行的工作估計記憶體（整段音訊陣列等）
+LANGUAGE_DETECT_WINDOWS = 3     # 檔案層級語言偵測：取樣段落數（全檔分組、每組取能量最高的一段）
+LANGUAGE_MIN_CONFIDENCE = 0.5   # 語言偵測信心低於此值時提示改用 --language 指定
+PROFILE_TRACE_SUFFIX = ".trace.json"   # 效能分析：Chrome trace（chrome://tracing 或 Perfetto 開啟）
+PROFILE_STATS_SUFFIX = ".pstats.txt"   # 效能分析：cProfile 依累計時間排序的統計
+HOST_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".config", "breeze-asr")   # autotune 產生的本機設定檔（host-<主機名稱>.json）
+AUTOTUNE_CLIP_SECONDS = 90      # autotune 量測用音訊長度
+AUTOTUNE_BATCH_SIZES = (1, 2, 4, 8)
+AUTOTUNE_SEGMENTATIONS = (      # (分段方式, 分段秒數, 重疊秒數)
+    ("fixed", CHUNK_SECONDS, OVERLAP_SECONDS),
+    ("silence", CHUNK_SECONDS, SNAP_OVERLAP_SECONDS),
+    ("fixed", 20, OVERLAP_SECONDS),
+    ("silence", 20, SNAP_OVERLAP_SECONDS),
+)
 # -----------------------------------
 
-def load_and_prepare(audio_path, target_sr=SR):
+# 排除訓練檢查點，只載入推論需要的檔案（避免下載 15GB 訓練檔案）
+# 注意：from_pretrained 不支援 ignore_patterns，需先用 snapshot_download 過濾（非 Windows）
+INFERENCE_IGNORE_PATTERNS = [
+    "*.bin",
+    "*.pkl",
+    "checkpoint-*",
+    "*.ckpt",
+    "*.pth",
+    "*.pt",
+    "whisper-github/*",
+]
+
+def compression_ratio(text):
+    """文字 UTF-8 位元組與 zlib 壓縮後長度之比；重複幻覺時會明顯偏高。"""
+    data = text.encode("utf-8")
+    if not data:
+        return 0.0
+    return len(data) / len(zlib.compress(data))
+
+def _find_tail_repetition(token_ids, max_ngram=REPEAT_MAX_NGRAM, min_repeats=REPEAT_MIN_REPEATS, min_span=REPEAT_MIN_SPAN_TOKENS):
+    """
+    檢查 token 序列尾端是否為同一 n-gram 連續重複。
+    回傳 (n, repeats) 或 None。
+    """
+    for n in range(1, max_ngram + 1):
+        unit = token_ids[-n:]
+        if len(unit) < n:
+            break
+        repeats = 1
+        while len(token_ids) >= n * (repeats + 1) and token_ids[-n * (repeats + 1):-n * repeats] == unit:
+            repeats += 1
+        if repeats >= min_repeats and n * repeats >= min_span:
+            return n, repeats
+    return None
+
+class RepetitionStoppingCriteria(StoppingCriteria):
+    """
+    生成過程中偵測重複迴圈（n-gram 連續重複或壓縮比暴增），觸發的列立即停止。
+    觸發原因記錄於 triggered：{batch_row: "ngram" | "compression"}。
+    """
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.eos_token_id = tokenizer.eos_token_id
+        self.special_ids = set(tokenizer.all_special_ids)
+        self.prompt_len = None
+        self.triggered = {}
+
+    def __call__(self, input_ids, scores, **kwargs):
+        # 第一次呼叫時已生成 1 個 token，據此推得 decoder prompt 長度
+        if self.prompt_len is None:
+            self.prompt_len = input_ids.shape[1] - 1
+        stop = []
+        for row in range(input_ids.shape[0]):
+            if row in self.triggered:
+                stop.append(True)
+                continue
+            generated = input_ids[row, self.prompt_len:].tolist()
+            if self.eos_token_id in generated:
+                # 已正常結束的列（後續皆為 padding），不再檢查
+                stop.append(False)
+                continue
+            generated = [t for t in generated if t not in self.special_ids]
+            reason = None
+            if _find_tail_repetition(generated) is not None:
+                reason = "ngram"
+            elif len(generated) >= LOOP_CHECK_MIN_TOKENS and len(generated) % LOOP_CHECK_EVERY == 0:
+                text = self.tokenizer.decode(generated, skip_special_tokens=True)
+                if compression_ratio(text) > COMPRESSION_RATIO_THRESHOLD:
+                    reason = "compression"
+            if reason is not None:
+                self.triggered[row] = reason
+            stop.append(reason is not None)
+        return torch.tensor(stop, dtype=torch.bool, device=input_ids.device)
+
+    def trim(self, token_ids):
+        """移除尾端重複的 n-gram，只保留一份（不論是否觸發停止）。"""
+        token_ids = [t for t in token_ids if t not in self.special_ids]
+        found = _find_tail_repetition(token_ids)
+        if found is None:
+            return token_ids
+        n, repeats = found
+        return token_ids[:len(token_ids) - n * (repeats - 1)]
+
+class TokenLogprobRecorder(LogitsProcessor):
+    """
+    放在 logits processor 最後，逐步累計每列所選 token 的 log 機率，用來計算段落的平均 log 機率。
+    第 t 步收到的 input_ids 已含第 t-1 步選出的 token，因此以上一步的分布查出其機率（只保留一步的分布，
+    不必 output_scores 保存整個生成過程的分數）；最後一步的 token 由 finish() 補上。僅適用 greedy / 取樣。
+    同一次 generate 內 input_ids 每步加長 1；否則視為新的一次呼叫（例如 Whisper 對部分段落以較小的 batch 再解碼），重新累計。
+    """
+    def __init__(self, eos_token_id):
+        self.eos_token_id = eos_token_id
+        self._prev = None
+        self._length = None
+        self.sums = None
+        self.counts = None
+        self.done = None
+
+    def _accumulate(self, tokens):
+        tokens = tokens.to(self._prev.device)
+        logprobs = self._prev.gather(1, tokens[:, None]).squeeze(1)
+        # 已結束的列之後只是 padding，不列入
+        active = ~self.done & torch.isfinite(logprobs)
+        self.sums += torch.where(active, logprobs, torch.zeros_like(logprobs))
+        self.counts += active.long()
+        self.done |= tokens == self.eos_token_id
+
+    def __call__(self, input_ids, scores):
+        same_call = (self._prev is not None and input_ids.shape[0] == self._prev.shape[0]
+                     and input_ids.shape[1] == self._length + 1)
+        if same_call:
+            self._accumulate(input_ids[:, -1])
+        else:
+            batch = scores.shape[0]
+            self.sums = torch.zeros(batch, dtype=torch.float32, device=scores.device)
+            self.counts = torch.zeros(batch, dtype=torch.long, device=scores.device)
+            self.done = torch.zeros(batch, dtype=torch.bool, device=scores.device)
+        self._length = input_ids.shape[1]
+        self._prev = torch.log_softmax(scores.float(), dim=-1)
+        return scores
+
+    def finish(self, sequences):
+        """回傳每列的平均 log 機率（沒有生成任何 token、或最後一次呼叫的列與 sequences 對不上時為 None）。"""
+        if self._prev is None or self._prev.shape[0] != sequences.shape[0]:
+            self._prev = None
+            return [None] * sequences.shape[0]
+        self._accumulate(sequences[:, -1])
+        self._prev = None
+        return [(s / c) if c else None for s, c in zip(self.sums.tolist(), self.counts.tolist())]
+
+class PartialTextStreamer(BaseStreamer):
+    """
+    generate 的 streamer：每產生一個 token 就把目前為止解碼出的文字回呼給 on_partial(text)。
+    僅支援 batch size 1；第一次 put 為 decoder prompt，略過。生成結束時呼叫 on_partial(None)。
+    """
+    def __init__(self, tokenizer, on_partial):
+        self.tokenizer = tokenizer
+        self.on_partial = on_partial
+        self.token_ids = []
+        self._prompt_skipped = False
+        self._last_text = ""
+
+    def put(self, value):
+        if value.dim() > 1:
+            if value.shape[0] > 1:
+                raise ValueError("PartialTextStreamer 只支援 batch size 1")
+            value = value[0]
+        if not self._prompt_skipped:
+            self._prompt_skipped = True
+            return
+        self.token_ids.extend(value.tolist())
+        text = self.tokenizer.decode(self.token_ids, skip_special_tokens=True).strip()
+        # 中文字可能被拆成多個 byte-level token，尚未湊齊時會解成 �，等下一個 token 再送
+        if text.endswith("\ufffd") or text == self._last_text:
+            return
+        self._last_text = text
+        self.on_partial(text)
+
+    def end(self):
+        self.on_partial(None)
+
+class TranscriptionCancelled(Exception):
+    """使用者取消轉錄；已完成的段落保留在進度檔中，可再次執行續跑。"""
+
+class InsufficientMemoryError(MemoryError):
+    """可用記憶體不足以安全繼續；已完成的段落保留在進度檔中。"""
+
+_GB = 1024 ** 3
+
+class MemoryGovernor:
+    """
+    以 psutil 取樣 RSS 與系統可用記憶體：
+    - plan()：開始前依可用記憶體決定批次大小與同時工作數
+    - batch_limit()：記憶體吃緊時縮小批次，回穩後逐步放大
+    - maybe_collect()：只在 RSS 成長或可用記憶體跌破門檻時才執行 GC
+    - check()：可用記憶體低於下限時先 GC，仍不足則拋出 InsufficientMemoryError
+    """
+    def __init__(self, low_watermark_gb=MEMORY_LOW_WATERMARK_GB, min_available_gb=MEMORY_MIN_AVAILABLE_GB,
+                 gc_growth_mb=GC_RSS_GROWTH_MB, per_chunk_gb=MEMORY_PER_CHUNK_GB, per_job_gb=MEMORY_PER_JOB_GB):
+        self.low_watermark = low_watermark_gb * _GB
+        self.min_available = min_available_gb * _GB
+        self.gc_growth = gc_growth_mb * 1024 ** 2
+        self.per_chunk = per_chunk_gb * _GB
+        self.per_job = per_job_gb * _GB
+        self.process = psutil.Process()
+        self._last_gc_rss = self.process.memory_info().rss
+        self._batch_cap = None
+        self._lock = threading.Lock()
+
+    def sample(self):
+        """回傳 (本程序 RSS, 系統可用記憶體)，單位 bytes。"""
+        return self.process.memory_info().rss, psutil.virtual_memory().available
+
+    def plan(self, batch_size, max_jobs=None):
+        """依目前可用記憶體決定 (批次大小, 同時工作數)；連一段都放不下時拒絕開始。"""
+        _, available = self.sample()
+        budget = available - self.min_available
+        if budget < self.per_chunk:
+            raise InsufficientMemoryError(
+                f"可用記憶體 {available/_GB:.1f}GB 不足（需保留 {self.min_available/_GB:.1f}GB + 每段約 {self.per_chunk/_GB:.2f}GB）")
+        planned_batch = max(1, min(batch_size, int(budget // self.per_chunk)))
+        remaining = budget - planned_batch * self.per_chunk
+        requested_jobs = max_jobs or planned_batch * 2
+        planned_jobs = max(1, min(requested_jobs, int(remaining // self.per_job)))
+        with self._lock:
+            self._batch_cap = planned_batch
+        if planned_batch < batch_size or planned_jobs < requested_jobs:
+            print(f"ⓘ 記憶體規劃：可用 {available/_GB:.1f}GB → 批次 {planned_batch}（要求 {batch_size}）、同時工作 {planned_jobs}（要求 {requested_jobs}）")
+        return planned_batch, planned_jobs
+
+    def batch_limit(self, requested):
+        """回傳本次可用的批次大小：吃緊時減半，可用記憶體充裕時每次加 1 直到回到 requested。"""
+        with self._lock:
+            _, available = self.sample()
+            cap = self._batch_cap or requested
+            if available < self.low_watermark and cap > 1:
+                cap = max(1, cap // 2)
+                print(f"⚠ 記憶體吃緊（可用 {available/_GB:.1f}GB），批次縮小為 {cap}")
+                self.collect()
+            elif available > 2 * self.low_watermark and cap < requested:
+                cap += 1
+            self._batch_cap = cap
+            return min(cap, requested)
+
+    def maybe_collect(self):
+        """RSS 成長超過門檻或可用記憶體跌破低水位時才執行 GC；回傳是否執行。"""
+        rss, available = self.sample()
+        if rss - self._last_gc_rss > self.gc_growth or available < self.low_watermark:
+            self.collect()
+            return True
+        return False
+
+    def collect(self):
+        gc.collect()
+        if torch.backends.mps.is_available() and torch.backends.mps.is_built():
+            torch.mps.empty_cache()
+        self._last_gc_rss = self.process.memory_info().rss
+
+    def check(self):
+        """可用記憶體低於下限時先 GC；仍不足則拋出 InsufficientMemoryError（而非等著被 OOM 終止）。"""
+        _, available = self.sample()
+        if available >= self.min_available:
+            return
+        self.collect()
+        _, available = self.sample()
+        if available < self.min_available:
+            raise InsufficientMemoryError(
+                f"可用記憶體僅剩 {available/_GB:.1f}GB（下限 {self.min_available/_GB:.1f}GB）")
+
+MEMORY_GOVERNOR = MemoryGovernor()
+
+class CancelStoppingCriteria(StoppingCriteria):
+    """於每個 token 生成後檢查取消旗標，讓 generate 可在段落中途停止。"""
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        stop = self.cancel_event.is_set()
+        return torch.full((input_ids.shape[0],), stop, dtype=torch.bool, device=input_ids.device)
+
+# ---------- 效能分析（--profile）----------
+_PROFILING = False
+_NO_STAGE = nullcontext()
+
+def _stage(name):
+    """效能分析時以 record_function 標記階段名稱；未啟用時回傳共用的 nullcontext（無額外成本）。"""
+    if _PROFILING:
+        return torch.profiler.record_function(name)
+    return _NO_STAGE
+
+class ChunkProfiler:
+    """
+    對指定範圍的段落（0-based，含頭尾）同時執行 torch.profiler 與 cProfile，
+    結束時於輸出檔旁寫出 Chrome trace 與排序後的 cProfile 統計。
+    encoder / decoder 階段以 forward hook 標記，只在分析期間掛上。
+    """
+    def __init__(self, output_text, model, first_chunk=0, last_chunk=0):
+        self.trace_path = output_text + PROFILE_TRACE_SUFFIX
+        self.stats_path = output_text + PROFILE_STATS_SUFFIX
+        self.model = model
+        self.first_chunk = first_chunk
+        self.last_chunk = last_chunk
+        self._torch_prof = None
+        self._cprof = None
+        self._hooks = []
+        self._open_stages = []
+        self.done = False
+
+    def covers(self, idx):
+        return self.first_chunk <= idx <= self.last_chunk
+
+    def _attach_stage_hooks(self):
+        whisper = getattr(self.model, "model", None)
+        for name in ("encoder", "decoder"):
+            module = getattr(whisper, name, None)
+            if module is None:
+                continue
+            def _pre(mod, args, _name=name):
+                rf = torch.profiler.record_function(_name)
+                rf.__enter__()
+                self._open_stages.append(rf)
+            def _post(mod, args, output):
+                if self._open_stages:
+                    self._open_stages.pop().__exit__(None, None, None)
+            self._hooks.append(module.register_forward_pre_hook(_pre))
+            self._hooks.append(module.register_forward_hook(_post))
+
+    def start(self):
+        global _PROFILING
+        if self._torch_prof is not None or self.done:
+            return
+        print(f"ⓘ 開始效能分析（第 {self.first_chunk+1} 段起）")
+        self._attach_stage_hooks()
+        self._torch_prof = torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU])
+        self._torch_prof.__enter__()
+        self._cprof = cProfile.Profile()
+        self._cprof.enable()
+        _PROFILING = True
+
+    def stop(self):
+        global _PROFILING
+        if self._torch_prof is None:
+            return
+        _PROFILING = False
+        self._cprof.disable()
+        self._torch_prof.__exit__(None, None, None)
+        for hook in self._hooks:
+            hook.remove()
+        self._hooks = []
+        self._open_stages = []
+        try:
+            self._torch_prof.export_chrome_trace(self.trace_path)
+            with open(self.stats_path, "w", encoding="utf-8") as f:
+                pstats.Stats(self._cprof, stream=f).sort_stats("cumulative").print_stats()
+            print(f"✓ 效能分析已輸出 → {self.trace_path}、{self.stats_path}")
+        except Exception as e:
+            print(f"⚠ 效能分析輸出失敗：{e}")
+        self._torch_prof = None
+        self._cprof = None
+        self.done = True
+
+def parse_chunk_range(text):
+    """解析 CLI 的段落範圍（1-based，例如 "3" 或 "2-5"），回傳 0-based (first, last)。"""
+    first, _, last = text.partition("-")
+    first = int(first)
+    last = int(last) if last else first
+    if first < 1 or last < first:
+        raise ValueError(f"段落範圍無效：{text}")
+    return first - 1, last - 1
+# -----------------------------------------
+
+def load_and_prepare(audio_path, target_sr=SR, keep_channels=False):
+    """
+    讀取音檔並重採樣至 target_sr，回傳 (arr, sr)。
+    預設將多聲道平均為單聲道 (samples,)；keep_channels=True 且為多聲道時改回傳 (channels, samples)。
+    """
     # 使用 soundfile 替代 torchaudio.load 避免 torchcodec 依賴問題
-    data, sr = sf.read(audio_path, dtype='float32')
-    
-    # 轉為 tensor 處理
-    if data.ndim == 2:  # 多聲道
-        data = data.mean(axis=1)  # 轉為單聲道
+    with _stage("load"):
+        data, sr = sf.read(audio_path, dtype='float32')
+        
+        # 轉為 tensor 處理
+        if data.ndim == 2:  # 多聲道
+            if keep_channels and data.shape[1] > 1:
+                data = np.ascontiguousarray(data.T)  # (channels, samples)
+            else:
+                data = data.mean(axis=1)  # 轉為單聲道
     
     # 重採樣（如需要）
-    if sr != target_sr:
-        waveform = torch.from_numpy(data).unsqueeze(0)  # (1, samples)
-        waveform = torchaudio.transforms.Resample(sr, target_sr)(waveform)
-        arr = waveform.squeeze(0).numpy().astype(np.float32)
-    else:
-        arr = data.astype(np.float32)
+    with _stage("resample"):
+        if sr != target_sr:
+            waveform = torch.from_numpy(data)
+            if waveform.ndim == 1:
+                waveform = waveform.unsqueeze(0)  # (1, samples)
+            waveform = torchaudio.transforms.Resample(sr, target_sr)(waveform)
+            arr = waveform.numpy().astype(np.float32)
+            if data.ndim == 1:
+                arr = arr[0]
+        else:
+            arr = data.astype(np.float32)
     
     return arr, target_sr
 
@@ -71,6 +500,63 @@ def compute_slices_with_overlap(total_samples, sr, chunk_seconds=CHUNK_SECONDS,
             break
     return slice_infos
 
+def short_time_energy(arr, sr, frame_seconds=ENERGY_FRAME_SECONDS, smooth_frames=ENERGY_SMOOTH_FRAMES):
+    """以不重疊 frame 計算平均能量（向量化），並做移動平均平滑，回傳 (envelope, frame_samples)。"""
+    frame = max(1, int(frame_seconds * sr))
+    n_frames = len(arr) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32), frame
+    frames = arr[:n_frames * frame].reshape(n_frames, frame)
+    energy = np.mean(frames * frames, axis=1)
+    if smooth_frames > 1:
+        energy = np.convolve(energy, np.ones(smooth_frames, dtype=np.float32) / smooth_frames, mode="same")
+    return energy, frame
+
+def compute_slices_snapped(arr, sr, chunk_seconds=CHUNK_SECONDS, overlap_seconds=SNAP_OVERLAP_SECONDS, search_seconds=SNAP_SEARCH_SECONDS):
+    """
+    靜音對齊切片：每段的目標終點為 start + chunk，改切在 [終點 - search, 終點] 內能量最低的位置，
+    下一段自切點往前 overlap 開始。每段長度仍不超過 chunk_seconds。
+    回傳格式同 compute_slices_with_overlap。
+    """
+    total_samples = arr.shape[0]
+    chunk_samples = int(chunk_seconds * sr)
+    overlap_samples = int(overlap_seconds * sr)
+    search_samples = int(search_seconds * sr)
+    if chunk_samples - search_samples <= overlap_samples:
+        raise ValueError("chunk_seconds must be larger than overlap_seconds + search_seconds")
+    if total_samples == 0:
+        return []
+
+    energy, frame = short_time_energy(arr, sr)
+    slice_infos = []
+    start = 0
+    while True:
+        target = start + chunk_samples
+        if target >= total_samples:
+            slice_infos.append((start, total_samples, start / sr, total_samples / sr))
+            break
+        # 只考慮完全落在 [target - search, target] 內的 frame，切在該 frame 中央
+        lo_frame = -(-max(start + overlap_samples + 1, target - search_samples) // frame)
+        hi_frame = min(target // frame, len(energy))
+        if hi_frame > lo_frame:
+            best = lo_frame + int(np.argmin(energy[lo_frame:hi_frame]))
+            cut = min(best * frame + frame // 2, target)
+        else:
+            cut = target
+        slice_infos.append((start, cut, start / sr, cut / sr))
+        start = cut - overlap_samples
+    return slice_infos
+
+def compute_slices(arr, sr, segmentation="fixed", chunk_seconds=CHUNK_SECONDS, overlap_seconds=None):
+    """依分段模式切片；overlap_seconds 為 None 時使用該模式的預設重疊。"""
+    if segmentation == "silence":
+        overlap = SNAP_OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+        return compute_slices_snapped(arr, sr, chunk_seconds, overlap)
+    if segmentation == "fixed":
+        overlap = OVERLAP_SECONDS if overlap_seconds is None else overlap_seconds
+        return compute_slices_with_overlap(arr.shape[0], sr, chunk_seconds, overlap)
+    raise ValueError(f"未知的分段模式：{segmentation}（可用：{', '.join(SEGMENTATION_MODES)}）")
+
 def normalize_text_for_matching(text):
     # 簡單正規化：去標點、多空格處理，回傳字詞列表
     s = text.strip()
@@ -110,6 +596,35 @@ def merge_two_segments(prev_text, curr_text, max_overlap_words=30, min_overlap=3
         # 若沒有重疊，直接用換行串接
         return prev_text.rstrip() + "\n" + curr_text.lstrip()
 
+def _merge_delta(running_text, txt):
+    """將 txt 併入 running_text（去除重疊），回傳 (合併後文字, 本段新增的部分)。"""
+    merged = merge_two_segments(running_text, txt) if running_text else txt
+    prefix = running_text.rstrip()
+    delta = merged[len(prefix):].strip() if merged.startswith(prefix) else txt
+    return merged, delta
+
+class ChannelMerger:
+    """
+    聲道分開模式的合併：各聲道各自與前一段去除重疊，
+    再依段落時間交錯輸出，每行標上聲道（[聲道1] ...）。
+    """
+
+    def __init__(self):
+        self.running = []
+
+    def add(self, channel_texts):
+        """加入下一段各聲道的文字，回傳本段新增內容（多行，可能為空字串）。"""
+        if len(self.running) < len(channel_texts):
+            self.running += [""] * (len(channel_texts) - len(self.running))
+        lines = []
+        for c, txt in enumerate(channel_texts):
+            if not txt:
+                continue
+            self.running[c], delta = _merge_delta(self.running[c], txt)
+            if delta:
+                lines.append(f"[聲道{c+1}] {delta}")
+        return "\n".join(lines)
+
 def _format_duration(secs: float) -> str:
     """將秒數格式化為 HH:MM:SS。"""
     total = int(round(secs))
@@ -117,75 +632,749 @@ def _format_duration(secs: float) -> str:
     h, m = divmod(m, 60)
     return f"{h:02d}:{m:02d}:{s:02d}"
 
-def transcribe_chunk_generate(arr_or_path, processor, model, device, sr_target=SR, max_time_warn=MAX_TIME_WARN, forced_decoder_ids=None):
+def _pad_to_whisper_window(arr, sr_target=SR):
+    """不足 30 秒的音訊補零至 30 秒（Whisper 標準輸入長度）。"""
+    min_samples = 30 * sr_target  # 480000 @ 16kHz
+    if len(arr) < min_samples:
+        arr = np.pad(arr, (0, min_samples - len(arr)), mode='constant', constant_values=0)
+    return arr
+
+def _safe_max_new_tokens(model):
+    max_target_positions = getattr(model.config, "max_target_positions", None)
+    if max_target_positions is None:
+        return 400
+    # 估計 decoder prompt len = 4（保守），margin 10
+    decoder_prompt_len = 4
+    margin = 10
+    safe_max_new_tokens = max(1, max_target_positions - decoder_prompt_len - margin)
+    return min(safe_max_new_tokens, 400)
+
+def _prepare_inputs(segments, processor, model, device, sr_target=SR):
+    """補齊 30 秒、計算 log-mel 特徵（fp32），移至裝置並轉為模型精度。"""
+    with _stage("features"):
+        arrs = [_pad_to_whisper_window(seg, sr_target) for seg in segments]
+        inputs = processor(arrs, sampling_rate=sr_target, return_tensors="pt", padding=True)
+
+    # WhisperProcessor 已自動生成正確的 attention_mask，無需手動設置
+    # 直接將輸入移至目標裝置
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    # log-mel 特徵以 fp32 計算，送進模型前才轉為模型精度
+    model_dtype = getattr(model, "dtype", torch.float32)
+    if model_dtype != torch.float32 and "input_features" in inputs:
+        inputs["input_features"] = inputs["input_features"].to(model_dtype)
+    return inputs
+
+def pick_speech_windows(arr_full, slice_list, n_windows=LANGUAGE_DETECT_WINDOWS):
+    """
+    挑選語言偵測用的段落索引：把全檔切成 n 組，每組取 RMS 能量最高的一段
+    （分散取樣，並避開靜音段）。
+    """
+    if not slice_list:
+        return []
+    energies = np.array([
+        float(np.sqrt(np.mean(np.square(arr_full[start:end])))) if end > start else 0.0
+        for start, end, _, _ in slice_list
+    ])
+    groups = np.array_split(np.arange(len(slice_list)), min(n_windows, len(slice_list)))
+    return [int(group[np.argmax(energies[group])]) for group in groups if len(group)]
+
+def detect_language(segments, processor, model, device, sr_target=SR):
+    """
+    以多段音訊一次決定語言：各段只跑 encoder 與 decoder 第一步，
+    對語言 token 的機率取平均。回傳 (語言代碼, 信心, {語言代碼: 機率})。
+    """
+    inputs = _prepare_inputs(segments, processor, model, device, sr_target)
+    lang_to_id = model.generation_config.lang_to_id
+    codes = list(lang_to_id)
+    lang_ids = [lang_to_id[c] for c in codes]
+    if isinstance(model, OnnxWhisperBackend):
+        logits = torch.from_numpy(model.language_logits(inputs["input_features"]))
+    else:
+        with torch.no_grad():
+            encoder_outputs = model.get_encoder()(inputs["input_features"])
+            sot = torch.full((len(segments), 1), model.generation_config.decoder_start_token_id, dtype=torch.long, device=device)
+            logits = model(encoder_outputs=encoder_outputs, decoder_input_ids=sot).logits[:, -1]
+    probs = torch.softmax(logits[:, lang_ids].float(), dim=-1).mean(dim=0).cpu()
+    best = int(torch.argmax(probs))
+    code = codes[best].strip("<|>")
+    return code, float(probs[best]), {c.strip("<|>"): float(p) for c, p in zip(codes, probs)}
+
+class EncoderCache:
+    """
+    磁碟上的 encoder 輸出快取：同一段音訊改用其他語言或解碼設定重新轉錄時，直接沿用 encoder 輸出，只需執行 decoder。
+    - key：段落 PCM（float32）的 SHA-256，加上命名空間（模型版本 / 後端 / 精度），模型更新後舊快取自然不再命中
+    - 每段存成 fp16 的 .npy（體積減半），讀取時以 mmap 開啟
+    - 總大小超過上限時依最近使用時間淘汰（命中時更新 mtime，即 LRU）
+    """
+    SUFFIX = ".npy"
+
+    def __init__(self, cache_dir=ENCODER_CACHE_DIR, max_mb=ENCODER_CACHE_MAX_MB, namespace=""):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_mb * 1024 ** 2)
+        self.namespace = namespace
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        # 現有項目的大小（含其他版本命名空間的檔案，一併計入上限）
+        self._entries = {}
+        for root, _, files in os.walk(cache_dir):
+            for name in files:
+                if name.endswith(self.SUFFIX):
+                    path = os.path.join(root, name)
+                    self._entries[path] = os.path.getsize(path)
+        self._total = sum(self._entries.values())
+
+    def key(self, segment):
+        h = hashlib.sha256(self.namespace.encode("utf-8"))
+        h.update(np.ascontiguousarray(segment, dtype=np.float32).tobytes())
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + self.SUFFIX)
+
+    def get(self, key):
+        """回傳 (frames, d_model) 的唯讀 fp16 mmap 陣列；未命中回傳 None。"""
+        path = self._path(key)
+        try:
+            hidden = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return hidden
+
+    def put(self, key, hidden):
+        """寫入單段 encoder 輸出；先寫暫存檔再 rename，其他程序不會讀到寫到一半的檔案。"""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, np.asarray(hidden, dtype=np.float16))
+        os.replace(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._total += size - self._entries.get(path, 0)
+            self._entries[path] = size
+            if self._total > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # 淘汰到上限的 90%，避免接近上限時每次寫入都要掃描
+        def _mtime(path):
+            try:
+                return os.path.getmtime(path)
+            except OSError:
+                return 0.0
+        target = self.max_bytes * 0.9
+        for path in sorted(self._entries, key=_mtime):
+            if self._total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self._total -= self._entries.pop(path)
+
+def _cached_encoder_outputs(segments, inputs, model, encoder_cache):
+    """
+    由 EncoderCache 取得各段的 encoder 輸出；未命中的段落以一次 encoder 前向計算後寫入快取。
+    新算出的結果同樣先轉為 fp16，首次與之後的重新解碼看到的 encoder 輸出一致。
+    回傳 BaseModelOutput（last_hidden_state 與 input_features 同裝置、同精度）。
+    """
+    keys = [encoder_cache.key(seg) for seg in segments]
+    hidden = [encoder_cache.get(key) for key in keys]
+    missing = [i for i, h in enumerate(hidden) if h is None]
+    features = inputs["input_features"]
+    if missing:
+        with torch.no_grad(), _stage("encoder"):
+            if isinstance(model, OnnxWhisperBackend):
+                computed = model.encode(features[missing])
+            else:
+                computed = model.get_encoder()(features[missing]).last_hidden_state.float().cpu().numpy()
+        for i, h in zip(missing, computed):
+            hidden[i] = h.astype(np.float16)
+            encoder_cache.put(keys[i], hidden[i])
+    stacked = np.stack([np.asarray(h, dtype=np.float32) for h in hidden])
+    return BaseModelOutput(last_hidden_state=torch.from_numpy(stacked).to(device=features.device, dtype=features.dtype))
+
+def transcribe_batch_generate(segments, processor, model, device, sr_target=SR, forced_decoder_ids=None, cancel_event=None, generate_overrides=None, on_partial=None, encoder_cache=None):
+    """
+    以單次 generate 轉錄多個段落（float32 / sr_target 的 ndarray，長度 ≤ 30 秒）。
+    回傳 (texts, infos, elapsed)；infos 為每段的解碼資訊 dict。例外直接拋出。
+    on_partial(text)：單段時逐 token 回呼目前的部分文字，生成結束時以 None 呼叫。
+    encoder_cache：指定 EncoderCache 時 encoder 輸出由快取提供（命中的段落只執行 decoder）。
+    """
+    inputs = _prepare_inputs(segments, processor, model, device, sr_target)
+
+    start = time.time()
+    with torch.no_grad():
+        gen_kwargs = dict(
+            **inputs,
+            max_new_tokens=_safe_max_new_tokens(model),
+            do_sample=False,
+            num_beams=1,
+            # 段落 ≤ 30 秒且不輸出時間戳：只呼叫一次 generate。否則輸出中出現成對時間戳的列會被 Whisper 以較小的 batch
+            # 再解碼一次，TokenLogprobRecorder、sequences_scores 與 streamer 的列便對不上原本的段落
+            force_unique_generate_call=True,
+        )
+        if forced_decoder_ids is not None:
+            gen_kwargs["forced_decoder_ids"] = forced_decoder_ids
+        if generate_overrides:
+            gen_kwargs.update(generate_overrides)
+        if encoder_cache is not None:
+            # 已提供 encoder_outputs 時 generate 不再執行 encoder；未指定語言時 HF 的語言偵測只接受兩者其一，須移除 input_features
+            gen_kwargs["encoder_outputs"] = _cached_encoder_outputs(segments, inputs, model, encoder_cache)
+            gen_kwargs.pop("input_features", None)
+        # 重複迴圈偵測：幻覺段落不必跑滿 max_new_tokens
+        repetition = RepetitionStoppingCriteria(processor.tokenizer)
+        criteria = [repetition]
+        if cancel_event is not None:
+            criteria.append(CancelStoppingCriteria(cancel_event))
+        gen_kwargs["stopping_criteria"] = StoppingCriteriaList(criteria)
+        if on_partial is not None and len(segments) == 1:
+            gen_kwargs["streamer"] = PartialTextStreamer(processor.tokenizer, on_partial)
+        # 信心指標：greedy / 取樣以 TokenLogprobRecorder 逐步累計；beam search 直接使用最佳 beam 的長度正規化分數
+        beam_search = gen_kwargs.get("num_beams", 1) > 1
+        recorder = None
+        if beam_search:
+            gen_kwargs.update(return_dict_in_generate=True, output_scores=True)
+        else:
+            recorder = TokenLogprobRecorder(processor.tokenizer.eos_token_id)
+            gen_kwargs["logits_processor"] = LogitsProcessorList([recorder])
+
+        output = model.generate(**gen_kwargs)
+    elapsed = time.time() - start
+    tokens = getattr(output, "sequences", output)
+    if recorder is not None:
+        avg_logprobs = recorder.finish(tokens)
+    elif getattr(output, "sequences_scores", None) is not None:
+        avg_logprobs = output.sequences_scores.float().cpu().tolist()
+    else:
+        avg_logprobs = [None] * len(segments)
+    # 取消時 generate 會提早返回，半截文字不可寫入進度
+    if cancel_event is not None and cancel_event.is_set():
+        raise TranscriptionCancelled()
+
+    decoded = processor.batch_decode(tokens, skip_special_tokens=True)
+    texts, infos = [], []
+    for row in range(len(segments)):
+        # beam search 時停止條件的列是 beam 而非段落，重複迴圈改由壓縮比判斷
+        truncate_reason = None if beam_search else repetition.triggered.get(row)
+        if truncate_reason is not None:
+            text = processor.tokenizer.decode(repetition.trim(tokens[row].tolist()), skip_special_tokens=True)
+        else:
+            text = decoded[row]
+        text = text.strip()
+        info = {"truncated": truncate_reason is not None}
+        if truncate_reason is not None:
+            info["truncate_reason"] = truncate_reason
+        if avg_logprobs[row] is not None:
+            info["avg_logprob"] = round(avg_logprobs[row], 4)
+        info["compression_ratio"] = round(compression_ratio(text), 3) if text else 0.0
+        texts.append(text)
+        infos.append(info)
+
+    # 釋放中間張量（避免長任務積累）
+    del inputs
+    del tokens
+    del output
+    return texts, infos, elapsed
+
+def transcribe_chunk_generate(arr_or_path, processor, model, device, sr_target=SR, max_time_warn=MAX_TIME_WARN, forced_decoder_ids=None, cancel_event=None, chunk_info=None, generate_overrides=None, on_partial=None, encoder_cache=None):
+    """
+    轉錄單一段落，回傳 (text, device, elapsed)。
+    - chunk_info：若提供 dict，會填入本段解碼資訊（truncated / truncate_reason）
+    - generate_overrides：覆寫 generate 參數（例如重新解碼時改用取樣）
+    - on_partial：逐 token 回呼目前解碼出的部分文字（串流顯示用）
+    - encoder_cache：EncoderCache，命中時略過 encoder
+    """
     try:
         # 支援直接傳入 ndarray（已是 float32/target_sr）或傳入音檔路徑
         if isinstance(arr_or_path, np.ndarray):
             arr = arr_or_path
-            sr = sr_target
             path_label = "(in-memory segment)"
         else:
             path = arr_or_path
-            arr, sr = load_and_prepare(path, target_sr=sr_target)
+            arr, _ = load_and_prepare(path, target_sr=sr_target)
             path_label = os.path.basename(path)
         
         # ✅ 自動檢測並 padding 音訊到 30 秒（Whisper 標準輸入長度）
-        min_samples = 30 * sr_target  # 480000 @ 16kHz
         original_duration = len(arr) / sr_target
-        
-        if len(arr) < min_samples:
-            padding_needed = min_samples - len(arr)
-            arr = np.pad(arr, (0, padding_needed), mode='constant', constant_values=0)
+        if len(arr) < 30 * sr_target:
             print(f"  ⓘ 音訊 {original_duration:.1f}s → 已自動填充至 30.0s")
-        
-        inputs = processor(arr, sampling_rate=sr, return_tensors="pt", padding=True)
-
-        # WhisperProcessor 已自動生成正確的 attention_mask，無需手動設置
-        # 直接將輸入移至目標裝置
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-
-        start = time.time()
-        with torch.no_grad():
-            max_target_positions = getattr(model.config, "max_target_positions", None)
-            if max_target_positions is None:
-                safe_max_new_tokens = 400
-            else:
-                # 估計 decoder prompt len = 4（保守），margin 10
-                decoder_prompt_len = 4
-                margin = 10
-                safe_max_new_tokens = max(1, max_target_positions - decoder_prompt_len - margin)
-                safe_max_new_tokens = min(safe_max_new_tokens, 400)
-
-            gen_kwargs = dict(
-                **inputs,
-                max_new_tokens=safe_max_new_tokens,
-                do_sample=False,
-                num_beams=1
-            )
-            if forced_decoder_ids is not None:
-                gen_kwargs["forced_decoder_ids"] = forced_decoder_ids
 
-            tokens = model.generate(**gen_kwargs)
-        elapsed = time.time() - start
-        text = processor.batch_decode(tokens, skip_special_tokens=True)[0]
-        text_clean = text.strip()
-        print(f"本段（{path_label}）在 {str(device)} 上推論耗時：{elapsed:.1f} 秒 (max_new_tokens={safe_max_new_tokens}) ；輸出字數：{len(text_clean)}")
+        texts, infos, elapsed = transcribe_batch_generate(
+            [arr], processor, model, device, sr_target=sr_target,
+            forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event,
+            generate_overrides=generate_overrides, on_partial=on_partial, encoder_cache=encoder_cache,
+        )
+        text_clean, info = texts[0], infos[0]
+        confidence = f"；平均 log 機率 {info['avg_logprob']:.2f}" if "avg_logprob" in info else ""
+        print(f"本段（{path_label}）在 {str(device)} 上推論耗時：{elapsed:.1f} 秒 (max_new_tokens={_safe_max_new_tokens(model)}) ；輸出字數：{len(text_clean)}{confidence}")
+        if info["truncated"]:
+            reason_label = "n-gram 重複" if info["truncate_reason"] == "ngram" else "壓縮比過高"
+            print(f"⚠ 偵測到重複迴圈（{reason_label}），已提早停止本段解碼並標記於進度檔")
+        if chunk_info is not None:
+            chunk_info.update(info)
         if elapsed > max_time_warn:
             print(f"⚠ 本段耗時 > {max_time_warn}s（{elapsed:.1f}s），建議改短 chunk 或測試 CPU。")
 
-        # 釋放中間張量與強制 GC（避免長任務積累）
-        try:
-            del inputs
-            del tokens
-        except Exception:
-            pass
-        gc.collect()
+        # 僅在記憶體壓力出現時 GC（避免每段都付出 GC 成本）
+        MEMORY_GOVERNOR.maybe_collect()
         return text_clean, str(device), elapsed
+    except TranscriptionCancelled:
+        raise
     except Exception as e:
         print(f"transcribe_chunk_generate 例外（device={device}）：{e}")
         traceback.print_exc()
         return "", str(device), None
 
+def transcribe_channels(segments, processor, model, device, forced_decoder_ids=None, cancel_event=None, generate_overrides=None, scheduler=None, job_id=None, encoder_cache=None, model_lock=None):
+    """
+    model_lock：不經 scheduler 直接推論時持有的鎖（與 scheduler 共用模型時避免同時推論）。
+    聲道分開模式：同一時間段的各聲道段落以一次 generate 批次轉錄（有 scheduler 時交給跨檔案批次），
+    兩個聲道的耗時約等於一次單聲道轉錄。近乎無聲（RMS < CHANNEL_SILENCE_RMS）的聲道不送入模型，文字為空字串。
+    回傳 (texts, device, elapsed, infos)，與 segments 一一對應；例外時 texts 全為空字串。
+    """
+    texts = [""] * len(segments)
+    infos = [{"truncated": False} for _ in segments]
+    active = [c for c, seg in enumerate(segments) if seg.size and float(np.sqrt(np.mean(np.square(seg)))) >= CHANNEL_SILENCE_RMS]
+    if not active:
+        return texts, str(device), 0.0, infos
+    try:
+        if scheduler is not None and generate_overrides is None:
+            futures = [scheduler.submit(segments[c], job_id, forced_decoder_ids) for c in active]
+            results = [f.result() for f in futures]
+            for c, (text, _, _, info) in zip(active, results):
+                texts[c], infos[c] = text, info
+            elapsed = max((r[2] or 0.0) for r in results)
+        else:
+            with model_lock or nullcontext():
+                batch_texts, batch_infos, elapsed = transcribe_batch_generate(
+                    [segments[c] for c in active], processor, model, device,
+                    forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, generate_overrides=generate_overrides,
+                    encoder_cache=encoder_cache,
+                )
+            for c, text, info in zip(active, batch_texts, batch_infos):
+                texts[c], infos[c] = text, info
+        print(f"本段 {len(active)}/{len(segments)} 個聲道在 {str(device)} 上批次推論耗時：{elapsed:.1f} 秒；輸出字數：{' / '.join(str(len(t)) for t in texts)}")
+        if any(info["truncated"] for info in infos):
+            print("⚠ 偵測到重複迴圈，已提早停止該聲道解碼並標記於進度檔")
+        MEMORY_GOVERNOR.maybe_collect()
+        return texts, str(device), elapsed, infos
+    except TranscriptionCancelled:
+        raise
+    except Exception as e:
+        print(f"transcribe_channels 例外（device={device}）：{e}")
+        traceback.print_exc()
+        return [""] * len(segments), str(device), None, [{"truncated": False} for _ in segments]
+
+def _channel_chunk_info(channel_texts, channel_infos):
+    """聲道分開模式的段落資訊：保留各聲道的解碼資訊，段落層級取最差的聲道（供續跑與第二階段判斷）。"""
+    info = {"channels": channel_texts, "channel_infos": channel_infos,
+            "truncated": any(i.get("truncated") for i in channel_infos)}
+    reasons = [i["truncate_reason"] for i in channel_infos if i.get("truncate_reason")]
+    if reasons:
+        info["truncate_reason"] = reasons[0]
+    logprobs = [i["avg_logprob"] for i in channel_infos if i.get("avg_logprob") is not None]
+    if logprobs:
+        info["avg_logprob"] = min(logprobs)
+    info["compression_ratio"] = max((i.get("compression_ratio", 0.0) for i in channel_infos), default=0.0)
+    if any(i.get("second_pass") for i in channel_infos):
+        info["second_pass"] = True
+    return info
+
+def needs_second_pass(info):
+    """低信心段落：因重複迴圈被截斷、平均 log 機率低於 LOGPROB_THRESHOLD，或壓縮比高於 COMPRESSION_RATIO_THRESHOLD。"""
+    if info.get("truncated"):
+        return True
+    if info.get("avg_logprob") is not None and info["avg_logprob"] < LOGPROB_THRESHOLD:
+        return True
+    return info.get("compression_ratio", 0.0) > COMPRESSION_RATIO_THRESHOLD
+
+def _confidence_key(info):
+    avg_logprob = info.get("avg_logprob")
+    return (not info.get("truncated"), info.get("compression_ratio", 0.0) <= COMPRESSION_RATIO_THRESHOLD,
+            avg_logprob if avg_logprob is not None else -math.inf)
+
+def second_pass_decode(segments, processor, model, device, texts, infos, forced_decoder_ids=None, cancel_event=None, encoder_cache=None):
+    """
+    第二階段解碼：只重新解碼 texts / infos 中低信心（needs_second_pass）且尚未處理過的段落。
+    先以 beam search（SECOND_PASS_BEAMS），仍未達門檻者依序以 SECOND_PASS_TEMPERATURES 取樣；
+    每段保留信心最高的結果（未截斷 > 壓縮比正常 > 平均 log 機率），info["second_pass"] 記錄採用的策略（kept 表示沿用第一階段）。
+    回傳更新後的 (texts, infos)。
+    """
+    texts, infos = list(texts), list(infos)
+    pending = [i for i, info in enumerate(infos) if texts[i] and needs_second_pass(info) and not info.get("second_pass")]
+    if not pending:
+        return texts, infos
+    best = {i: (texts[i], {**infos[i], "second_pass": "kept"}) for i in pending}
+    strategies = [(f"beam{SECOND_PASS_BEAMS}", {"num_beams": SECOND_PASS_BEAMS})]
+    strategies += [(f"t={t:g}", {"do_sample": True, "temperature": t}) for t in SECOND_PASS_TEMPERATURES]
+    for label, overrides in strategies:
+        if not pending:
+            break
+        try:
+            new_texts, new_infos, elapsed = transcribe_batch_generate(
+                [segments[i] for i in pending], processor, model, device,
+                forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, generate_overrides=overrides,
+                encoder_cache=encoder_cache,
+            )
+        except TranscriptionCancelled:
+            raise
+        except Exception as e:
+            print(f"⚠ 第二階段解碼失敗（{label}）：{e}")
+            continue
+        print(f"  第二階段 {label}：{len(pending)} 段，耗時 {elapsed:.1f} 秒")
+        for i, text, info in zip(pending, new_texts, new_infos):
+            if text and _confidence_key(info) > _confidence_key(best[i][1]):
+                best[i] = (text, {**info, "second_pass": label})
+        pending = [i for i in pending if needs_second_pass(best[i][1])]
+    for i, (text, info) in best.items():
+        texts[i], infos[i] = text, info
+    return texts, infos
+
+# ---------- ONNX Runtime 後端（--backend onnx）----------
+class OnnxWhisperBackend:
+    """
+    以 ONNX Runtime 在 CPU 上執行 Whisper greedy 解碼（encoder + decoder + decoder-with-past）。
+    提供與 WhisperForConditionalGeneration.generate 相容的最小介面，
+    transcribe_batch_generate / transcribe_chunk_generate 可直接把它當作 model 使用。
+    需要選用套件：onnxruntime（推論）、optimum（僅首次匯出）。
+    """
+    ENCODER_FILE = "encoder_model.onnx"
+    DECODER_FILE = "decoder_model.onnx"
+    DECODER_WITH_PAST_FILE = "decoder_with_past_model.onnx"
+
+    def __init__(self, onnx_dir):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("ONNX 後端需要 onnxruntime：uv sync --extra onnx") from e
+        from transformers import WhisperConfig, GenerationConfig
+        self.config = WhisperConfig.from_pretrained(onnx_dir)
+        self.generation_config = GenerationConfig.from_pretrained(onnx_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        physical_cores = psutil.cpu_count(logical=False)
+        if physical_cores:
+            options.intra_op_num_threads = physical_cores
+        providers = ["CPUExecutionProvider"]
+        self.encoder = ort.InferenceSession(os.path.join(onnx_dir, self.ENCODER_FILE), sess_options=options, providers=providers)
+        self.decoder = ort.InferenceSession(os.path.join(onnx_dir, self.DECODER_FILE), sess_options=options, providers=providers)
+        self.decoder_with_past = ort.InferenceSession(os.path.join(onnx_dir, self.DECODER_WITH_PAST_FILE), sess_options=options, providers=providers)
+
+    @classmethod
+    def export(cls, onnx_dir, model_path=MODEL_ID, cache_dir=None):
+        """將模型匯出為 encoder / decoder / decoder-with-past 三個 ONNX 檔（不合併 decoder）。"""
+        try:
+            from optimum.exporters.onnx import main_export
+        except ImportError as e:
+            raise ImportError("首次匯出 ONNX 需要 optimum-onnx：uv sync --extra onnx") from e
+        from transformers import WhisperConfig, GenerationConfig
+        os.makedirs(onnx_dir, exist_ok=True)
+        main_export(
+            model_path,
+            output=onnx_dir,
+            task="automatic-speech-recognition-with-past",
+            device="cpu",
+            no_post_process=True,
+            cache_dir=cache_dir,
+        )
+        WhisperConfig.from_pretrained(model_path, cache_dir=cache_dir).save_pretrained(onnx_dir)
+        GenerationConfig.from_pretrained(model_path, cache_dir=cache_dir).save_pretrained(onnx_dir)
+
+    @classmethod
+    def load_or_export(cls, onnx_dir=ONNX_CACHE_DIR, model_path=MODEL_ID, force=False, cache_dir=None):
+        """已有快取的 ONNX 檔則直接載入，否則先匯出（僅首次，需數分鐘）；force=True 時一律重新匯出。"""
+        required = (cls.ENCODER_FILE, cls.DECODER_FILE, cls.DECODER_WITH_PAST_FILE, "config.json", "generation_config.json")
+        if force or not all(os.path.exists(os.path.join(onnx_dir, name)) for name in required):
+            print(f"ⓘ 首次使用 ONNX 後端：匯出模型至 {onnx_dir}（僅需一次，可能需要數分鐘）...")
+            start = time.time()
+            cls.export(onnx_dir, model_path=model_path, cache_dir=cache_dir)
+            print(f"✓ ONNX 匯出完成（{time.time() - start:.0f} 秒）")
+        return cls(onnx_dir)
+
+    @staticmethod
+    def _run(session, feeds):
+        # 只傳入該 session 需要的輸入（不同 optimum 版本的 decoder 輸入略有差異）
+        wanted = {i.name for i in session.get_inputs()}
+        missing = wanted - feeds.keys()
+        if missing:
+            raise KeyError(f"ONNX 模型需要未提供的輸入：{sorted(missing)}")
+        outputs = session.run(None, {k: v for k, v in feeds.items() if k in wanted})
+        return dict(zip([o.name for o in session.get_outputs()], outputs))
+
+    def _first_step_logits(self, encoder_hidden_states):
+        batch = encoder_hidden_states.shape[0]
+        sot = np.full((batch, 1), self.generation_config.decoder_start_token_id, dtype=np.int64)
+        return self._run(self.decoder, {"input_ids": sot, "encoder_hidden_states": encoder_hidden_states})["logits"][:, -1]
+
+    def language_logits(self, input_features):
+        """<|startoftranscript|> 後第一步的 logits（供檔案層級語言偵測）。"""
+        features = input_features.detach().cpu().float().numpy()
+        encoder_hidden_states = self._run(self.encoder, {"input_features": features})["last_hidden_state"]
+        return self._first_step_logits(encoder_hidden_states)
+
+    def _detect_language(self, encoder_hidden_states):
+        """與 HF 相同：未指定語言時，以 <|startoftranscript|> 後第一步的 logits 選出語言 token。"""
+        logits = self._first_step_logits(encoder_hidden_states)
+        lang_ids = np.array(sorted(self.generation_config.lang_to_id.values()), dtype=np.int64)
+        return lang_ids[np.argmax(logits[:, lang_ids], axis=-1)]
+
+    def _prompt(self, encoder_hidden_states, forced_decoder_ids):
+        gen_config = self.generation_config
+        batch = encoder_hidden_states.shape[0]
+        if forced_decoder_ids is not None:
+            prompt = [gen_config.decoder_start_token_id] + [tok for _, tok in sorted(forced_decoder_ids)]
+            return np.tile(np.array(prompt, dtype=np.int64), (batch, 1))
+        lang = self._detect_language(encoder_hidden_states)
+        rest = np.array([gen_config.task_to_id["transcribe"], gen_config.no_timestamps_token_id], dtype=np.int64)
+        sot = np.full((batch, 1), gen_config.decoder_start_token_id, dtype=np.int64)
+        return np.concatenate([sot, lang[:, None], np.tile(rest, (batch, 1))], axis=1)
+
+    def encode(self, input_features):
+        """執行 encoder，回傳 last_hidden_state（numpy float32）。"""
+        return self._run(self.encoder, {"input_features": input_features.detach().cpu().float().numpy()})["last_hidden_state"]
+
+    def generate(self, input_features=None, max_new_tokens=400, forced_decoder_ids=None, stopping_criteria=None, num_beams=1, do_sample=False, streamer=None, logits_processor=None, encoder_outputs=None, **kwargs):
+        """greedy 解碼；回傳 (batch, prompt + 生成) 的 token tensor，已結束的列以 eos 補齊。"""
+        if num_beams != 1 or do_sample:
+            raise ValueError("ONNX 後端僅支援 greedy 解碼（num_beams=1, do_sample=False）")
+        gen_config = self.generation_config
+        eos = gen_config.eos_token_id
+        suppress = np.array(gen_config.suppress_tokens or [], dtype=np.int64)
+        begin_suppress = np.array(gen_config.begin_suppress_tokens or [], dtype=np.int64)
+
+        if encoder_outputs is not None:
+            encoder_hidden_states = encoder_outputs.last_hidden_state.detach().cpu().float().numpy()
+        else:
+            with _stage("encoder"):
+                encoder_hidden_states = self.encode(input_features)
+        sequences = self._prompt(encoder_hidden_states, forced_decoder_ids)
+        batch = sequences.shape[0]
+        finished = np.zeros(batch, dtype=bool)
+        if streamer is not None:
+            streamer.put(torch.from_numpy(sequences))
+
+        feeds = {"input_ids": sequences, "encoder_hidden_states": encoder_hidden_states}
+        session = self.decoder
+        with _stage("decoder"):
+            for step in range(max_new_tokens):
+                outputs = self._run(session, feeds)
+                logits = outputs["logits"][:, -1].astype(np.float32)
+                if suppress.size:
+                    logits[:, suppress] = -np.inf
+                if step == 0 and begin_suppress.size:
+                    logits[:, begin_suppress] = -np.inf
+                if logits_processor is not None:
+                    logits = logits_processor(torch.from_numpy(sequences), torch.from_numpy(logits)).numpy()
+                next_tokens = np.where(finished, eos, np.argmax(logits, axis=-1)).astype(np.int64)
+                sequences = np.concatenate([sequences, next_tokens[:, None]], axis=1)
+                if streamer is not None:
+                    streamer.put(torch.from_numpy(next_tokens))
+                finished |= next_tokens == eos
+                if stopping_criteria is not None:
+                    finished |= stopping_criteria(torch.from_numpy(sequences), None).cpu().numpy()
+                if finished.all():
+                    break
+
+                # 下一步改用 decoder-with-past：present.* → past_key_values.*；encoder 端的 KV 沿用第一步輸出
+                for name, value in outputs.items():
+                    if name.startswith("present."):
+                        feeds["past_key_values." + name[len("present."):]] = value
+                feeds["input_ids"] = next_tokens[:, None]
+                session = self.decoder_with_past
+        if streamer is not None:
+            streamer.end()
+        return torch.from_numpy(sequences)
+
+
+def compare_engines(input_audio, configs, n_chunks=3, language=None, min_similarity=PARITY_MIN_SIMILARITY):
+    """
+    以同一音檔前 n 段比較多組引擎設定（configs 為 {標籤: TranscriptionEngine 參數}，第一組為基準）：
+    列印各組即時率（RTF，越小越快）與相對基準的文字一致性，回傳 {標籤: {"text", "elapsed", "rtf", "similarity", "passed"}}。
+    passed：文字一致性是否達 min_similarity。
+    """
+    arr, sr = load_and_prepare(os.path.expanduser(input_audio), target_sr=SR)
+    slices = compute_slices_with_overlap(arr.shape[0], sr, CHUNK_SECONDS, OVERLAP_SECONDS)[:n_chunks]
+    audio_seconds = sum(end - start for start, end, _, _ in slices) / sr
+    results = {}
+    for label, engine_kwargs in configs.items():
+        engine = TranscriptionEngine(**engine_kwargs)
+        engine.load()
+        forced_decoder_ids = engine.processor.get_decoder_prompt_ids(language=language, task="transcribe") if language else None
+        texts = []
+        start = time.time()
+        for start_sample, end_sample, _, _ in slices:
+            txt, _, _ = transcribe_chunk_generate(arr[start_sample:end_sample], engine.processor, engine.model, engine.device, forced_decoder_ids=forced_decoder_ids)
+            texts.append(txt)
+        elapsed = time.time() - start
+        results[label] = {"text": "\n".join(texts), "elapsed": elapsed, "rtf": elapsed / audio_seconds}
+        del engine
+        gc.collect()
+
+    labels = list(results)
+    reference = results[labels[0]]
+    print(f"\n=== 比較結果（{len(slices)} 段，{audio_seconds:.0f} 秒音訊，基準：{labels[0]}）===")
+    for label in labels:
+        r = results[label]
+        r["similarity"] = difflib.SequenceMatcher(None, reference["text"], r["text"]).ratio()
+        r["passed"] = r["similarity"] >= min_similarity
+        print(f"{label:>6}：耗時 {r['elapsed']:.1f} 秒，RTF {r['rtf']:.3f}，"
+              f"加速比 {reference['elapsed'] / r['elapsed']:.2f}x，文字一致性 {r['similarity']:.1%}")
+    failed = [label for label in labels if not results[label]["passed"]]
+    if failed:
+        print(f"✗ 文字一致性低於門檻 {min_similarity:.1%}：{', '.join(failed)}")
+    else:
+        print(f"✓ 文字一致性皆達門檻 {min_similarity:.1%}")
+    return results
+
+def compare_backends(input_audio, n_chunks=3, language=None, min_similarity=PARITY_MIN_SIMILARITY):
+    """PyTorch 與 ONNX Runtime 後端（皆在 CPU）的一致性與速度比較。"""
+    return compare_engines(input_audio, {
+        "torch": {"backend": "torch", "device": "cpu"},
+        "onnx": {"backend": "onnx"},
+    }, n_chunks=n_chunks, language=language, min_similarity=min_similarity)
+
+def check_dtype_parity(input_audio, dtype, n_chunks=3, language=None, min_similarity=PARITY_MIN_SIMILARITY):
+    """以 fp32 為基準，檢查降精度推論（bf16 / fp16）的輸出一致性與速度。"""
+    return compare_engines(input_audio, {
+        "fp32": {"dtype": "fp32"},
+        dtype: {"dtype": dtype},
+    }, n_chunks=n_chunks, language=language, min_similarity=min_similarity)
+
+def host_profile_path(hostname=None):
+    """本機調校設定檔路徑：~/.config/breeze-asr/host-<主機名稱>.json。"""
+    hostname = re.sub(r"[^\w.-]", "_", hostname or platform.node() or "localhost")
+    return os.path.join(HOST_PROFILE_DIR, f"host-{hostname}.json")
+
+def load_host_profile(path=None):
+    """讀取 autotune 產生的本機設定；不存在或無法解析時回傳 {}。"""
+    path = path or host_profile_path()
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def host_profile_tuning(profile, backend, dtype_name):
+    """
+    本機設定中的批次大小與執行緒數（{"batch_size": ..., "threads": ...}）。兩者的最佳值取決於後端與精度，
+    只在與量測時相同時回傳，否則為 {}（舊版設定檔沒有記錄時視為 torch / fp32）。
+    """
+    if not profile:
+        return {}
+    measured = (profile.get("backend", "torch"), profile.get("dtype", "fp32"))
+    if measured != (backend, dtype_name):
+        print(f"ⓘ 本機調校設定量測於 {measured[0]} / {measured[1]}，與目前的 {backend} / {dtype_name} 不同，不套用批次大小與執行緒數")
+        return {}
+    return {k: profile[k] for k in ("batch_size", "threads") if profile.get(k)}
+
+def synthetic_clip(seconds, sr=SR, seed=0):
+    """合成量測用音訊：不同基頻的諧波母音片段與短暫停頓交錯（只用於量測速度，不含實際語音）。"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * sr)
+    pieces, n = [], 0
+    while n < total:
+        t = np.arange(int(rng.uniform(0.3, 1.2) * sr)) / sr
+        f0 = rng.uniform(100, 250)
+        tone = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 6)) * np.hanning(t.size) * 0.1
+        pause = np.zeros(int(rng.uniform(0.05, 0.6) * sr))
+        pieces += [tone, pause]
+        n += tone.size + pause.size
+    arr = np.concatenate(pieces)[:total] + rng.normal(0, 0.003, total)
+    return arr.astype(np.float32)
+
+def _autotune_thread_candidates():
+    physical = psutil.cpu_count(logical=False) or os.cpu_count() or 1
+    logical = os.cpu_count() or physical
+    return sorted({max(1, physical // 2), physical, logical})
+
+def autotune(input_audio=None, clip_seconds=AUTOTUNE_CLIP_SECONDS, backend="torch", dtype="fp32", language=None, output_path=None):
+    """
+    在本機量測各組設定的即時率（RTF，越小越快），最佳組合寫入本機設定檔（host_profile_path()），
+    之後 main() / 資料夾模式在未明確指定時自動套用。
+    依序掃描執行緒數（僅 torch 後端）、批次大小、分段設定，每一輪固定其餘維度為目前最佳值。
+    未指定 input_audio 時使用合成音訊；實際錄音的解碼長度較具代表性，建議指定。
+    """
+    engine = TranscriptionEngine(backend=backend, dtype=dtype)
+    engine.load()
+    if input_audio:
+        arr, sr = load_and_prepare(os.path.expanduser(input_audio), target_sr=SR)
+        arr = arr[:int(clip_seconds * sr)]
+        source = os.path.abspath(os.path.expanduser(input_audio))
+    else:
+        print("⚠ 未指定音檔，使用合成音訊量測（建議以 --audio 指定一段實際錄音）")
+        arr, sr, source = synthetic_clip(clip_seconds), SR, "synthetic"
+    audio_seconds = arr.shape[0] / sr
+    forced_decoder_ids = engine.processor.get_decoder_prompt_ids(language=language, task="transcribe") if language else None
+
+    best = {"segmentation": "fixed", "chunk_seconds": CHUNK_SECONDS, "overlap_seconds": OVERLAP_SECONDS,
+            "batch_size": 1, "threads": torch.get_num_threads()}
+    measured = {}
+
+    def _measure(config):
+        key = tuple(sorted(config.items()))
+        if key not in measured:
+            torch.set_num_threads(config["threads"])
+            slices = compute_slices(arr, sr, config["segmentation"], config["chunk_seconds"], config["overlap_seconds"])
+            segments = [arr[start:end] for start, end, _, _ in slices]
+            start = time.time()
+            for i in range(0, len(segments), config["batch_size"]):
+                transcribe_batch_generate(segments[i:i + config["batch_size"]], engine.processor, engine.model, engine.device, forced_decoder_ids=forced_decoder_ids)
+            rtf = (time.time() - start) / audio_seconds
+            measured[key] = {**config, "rtf": rtf}
+            print(f"  {config['segmentation']:>7} {config['chunk_seconds']:g}s/{config['overlap_seconds']:g}s"
+                  f"  batch {config['batch_size']}  threads {config['threads']:>3}  →  RTF {rtf:.3f}")
+        return measured[key]["rtf"]
+
+    # 暖機：首次 generate 含記憶體配置與 kernel 初始化，不列入比較
+    print(f"暖機中...（{engine.backend} / {engine.device} / {engine.dtype_name}，音訊 {audio_seconds:.0f} 秒）")
+    transcribe_batch_generate([arr[:int(CHUNK_SECONDS * sr)]], engine.processor, engine.model, engine.device, forced_decoder_ids=forced_decoder_ids)
+
+    max_batch, _ = MEMORY_GOVERNOR.plan(max(AUTOTUNE_BATCH_SIZES))
+    sweeps = []
+    if engine.backend == "torch":
+        # ONNX Runtime 的執行緒數在建立 session 時決定，不在此掃描
+        sweeps.append(("執行緒數", [{"threads": n} for n in _autotune_thread_candidates()]))
+    sweeps.append(("批次大小", [{"batch_size": b} for b in AUTOTUNE_BATCH_SIZES if b <= max_batch]))
+    sweeps.append(("分段設定", [{"segmentation": seg, "chunk_seconds": chunk, "overlap_seconds": overlap}
+                                for seg, chunk, overlap in AUTOTUNE_SEGMENTATIONS]))
+    for name, candidates in sweeps:
+        print(f"\n掃描{name}：")
+        best.update(min(candidates, key=lambda changes: _measure({**best, **changes})))
+    best_rtf = _measure(best)
+
+    profile = {
+        "host": platform.node(),
+        "created": datetime.now().isoformat(),
+        "source": source,
+        "audio_seconds": audio_seconds,
+        "backend": engine.backend,
+        "device": str(engine.device),
+        "dtype": engine.dtype_name,
+        **best,
+        "rtf": best_rtf,
+        "results": sorted(measured.values(), key=lambda r: r["rtf"]),
+    }
+    output_path = output_path or host_profile_path()
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, indent=2)
+    print(f"\n最佳設定：{best['segmentation']} {best['chunk_seconds']:g}s/{best['overlap_seconds']:g}s，"
+          f"batch {best['batch_size']}，threads {best['threads']}（RTF {best_rtf:.3f}）")
+    print(f"已寫入本機設定 → {output_path}")
+    return profile
+# -----------------------------------------
+
 def check_system_requirements():
     print("=== 系統檢查 ===")
     print(f"PyTorch 版本: {torch.__version__}")
@@ -197,7 +1386,7 @@ def check_system_requirements():
     mem = psutil.virtual_memory()
     print(f"記憶體: {mem.total/(1024**3):.1f}GB (可用 {mem.available/(1024**3):.1f}GB)")
     if mem.available < 4*(1024**3):
-        print("⚠ 可用記憶體低於 4GB")
+        print(f"⚠ 可用記憶體低於 4GB（低於 {MEMORY_MIN_AVAILABLE_GB:.1f}GB 時會停止並保留進度）")
 
 def save_progress_json(prog_path, data):
     # 確保父目錄存在（Windows 可能需要）
@@ -217,6 +1406,340 @@ def load_progress_json(prog_path):
     except Exception:
         return {}
 
+def _progress_segment_meta(meta):
+    """進度中的分段設定（舊版進度檔沒有這些欄位，視為 fixed / 30s / 3s / 單聲道）。"""
+    return {k: meta.get(k, default) for k, default in
+            (("segmentation", "fixed"), ("chunk_seconds", CHUNK_SECONDS), ("overlap_seconds", OVERLAP_SECONDS), ("channels", 1))}
+
+def resumable_segment_settings(output_text, store=None):
+    """
+    output_text 既有工作（工作庫，或 JSON 進度檔）的分段設定 (segmentation, chunk_seconds, overlap_seconds)；
+    沒有可續跑的工作時回傳 None。續跑須沿用這組設定，段落索引才對得上已完成的段落。
+    """
+    meta = store.job_meta(output_text) if store is not None else None
+    if meta is None:
+        progress = load_progress_json(output_text + PROGRESS_FILE_SUFFIX)
+        if "chunks" not in progress:
+            return None
+        meta = progress.get("meta", {})
+    segment_meta = _progress_segment_meta(meta)
+    return segment_meta["segmentation"], segment_meta["chunk_seconds"], segment_meta["overlap_seconds"]
+
+
+class ProgressFile:
+    """
+    單一輸出的 JSON 進度檔（output_text + PROGRESS_FILE_SUFFIX），僅供單一程序使用。
+    介面與 JobStore.open_job() 回傳的 StoreJob 相同，main() 兩者擇一使用。
+    """
+
+    def __init__(self, output_text, input_audio, segment_meta):
+        self.path = output_text + PROGRESS_FILE_SUFFIX
+        self.location = self.path
+        progress = load_progress_json(self.path)
+        # progress format: { "chunks": { idx_str: {"start":..., "end":..., "text":..., "device":..., "elapsed":..., "truncated":... } }, "meta": {...} }
+        # 分段設定不同時，舊進度的段落索引已對不上，需重新開始
+        if "chunks" in progress:
+            previous = _progress_segment_meta(progress.get("meta", {}))
+            if previous != segment_meta:
+                print(f"⚠ 進度檔的分段設定（{previous}）與本次不同，重新開始轉錄")
+                progress = {}
+        if "chunks" not in progress:
+            progress = {"chunks": {}, "meta": {"input_audio": input_audio, "created": datetime.now().isoformat(), **segment_meta}}
+        self.data = progress
+
+    @property
+    def meta(self):
+        return self.data["meta"]
+
+    def set_meta(self, **values):
+        # 與段落一併在下次 save() 時寫入
+        self.data["meta"].update(values)
+
+    def claim(self, n_total):
+        """依序走訪所有段落；已完成的段落由呼叫端依 get() 判斷是否跳過。"""
+        return iter(range(n_total))
+
+    def get(self, idx):
+        return self.data["chunks"].get(str(idx))
+
+    def save(self, idx, record):
+        self.data["chunks"][str(idx)] = record
+        save_progress_json(self.path, self.data)
+
+    def keep(self, idx):
+        pass
+
+    def release(self, idx):
+        pass
+
+    def records(self):
+        """已完成段落 {idx: record}。"""
+        return {int(k): v for k, v in self.data["chunks"].items() if v.get("text")}
+
+    def pending_count(self):
+        return 0
+
+    def finalize(self):
+        return True
+
+    def finish(self):
+        pass
+
+
+class JobStore:
+    """
+    以 SQLite（WAL 模式）保存所有工作與段落的進度，可由多個程序 / 執行緒共用：
+    同一個長檔或一整批檔案可由多個 worker 同時處理，各自以 claim 原子領取下一個未完成段落，
+    最後完成的 worker 負責合併並寫出逐字稿。
+    既有的 JSON 進度檔會在首次開啟工作時匯入，續跑行為與 JSON 模式相同。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id      TEXT PRIMARY KEY,           -- 輸出檔絕對路徑
+        input_audio TEXT NOT NULL,
+        meta        TEXT NOT NULL,              -- JSON：分段設定、偵測到的語言等
+        status      TEXT NOT NULL,              -- running / finalizing / done
+        created     REAL NOT NULL,
+        updated     REAL NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS chunks (
+        job_id      TEXT NOT NULL REFERENCES jobs(job_id),
+        idx         INTEGER NOT NULL,
+        start_sec   REAL NOT NULL,
+        end_sec     REAL NOT NULL,
+        status      TEXT NOT NULL DEFAULT 'pending',   -- pending / running / done
+        worker      TEXT,
+        claimed_at  REAL,
+        finished_at REAL,
+        text        TEXT,
+        device      TEXT,
+        elapsed     REAL,
+        truncated   INTEGER NOT NULL DEFAULT 0,
+        info        TEXT,                       -- JSON：其餘解碼資訊（truncate_reason 等）
+        PRIMARY KEY (job_id, idx)
+    );
+    CREATE INDEX IF NOT EXISTS chunks_by_status ON chunks(job_id, status, idx);
+    """
+    _RECORD_COLUMNS = ("start", "end", "text", "device", "elapsed", "truncated")
+
+    def __init__(self, path, lease_seconds=STORE_LEASE_SECONDS):
+        self.path = os.path.expanduser(path)
+        parent_dir = os.path.dirname(self.path)
+        if parent_dir and not os.path.exists(parent_dir):
+            os.makedirs(parent_dir, exist_ok=True)
+        self.lease_seconds = lease_seconds
+        self.worker = f"{platform.node()}:{os.getpid()}"
+        # isolation_level=None：自行以 BEGIN IMMEDIATE 控制交易；同一連線由 _lock 保護，可跨執行緒共用
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self.SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE 一開始就取得寫入鎖，領取段落時不會有兩個 worker 讀到同一筆 pending
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def job_meta(self, output_text):
+        """output_text 工作的 meta；工作庫中沒有此工作時回傳 None。"""
+        with self._lock:
+            row = self._conn.execute("SELECT meta FROM jobs WHERE job_id=?", (os.path.abspath(output_text),)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def open_job(self, output_text, input_audio, slice_list, segment_meta, requeue=None):
+        """
+        建立或續用 output_text 的工作；分段設定不同時重新開始。回傳 StoreJob。
+        requeue(record) 為真的已完成段落會重新排入佇列（例如要重新解碼的截斷或低信心段落）。
+        """
+        job_id = os.path.abspath(output_text)
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute("SELECT meta FROM jobs WHERE job_id=?", (job_id,)).fetchone()
+            meta = json.loads(row[0]) if row else {}
+            if row is not None and _progress_segment_meta(meta) != segment_meta:
+                print(f"⚠ 工作庫中的分段設定（{_progress_segment_meta(meta)}）與本次不同，重新開始轉錄")
+                conn.execute("DELETE FROM chunks WHERE job_id=?", (job_id,))
+                row = None
+            if row is None:
+                meta = {"input_audio": input_audio, "created": datetime.now().isoformat(), **segment_meta}
+                conn.execute("INSERT OR REPLACE INTO jobs(job_id, input_audio, meta, status, created, updated) VALUES (?, ?, ?, 'running', ?, ?)",
+                             (job_id, input_audio, json.dumps(meta, ensure_ascii=False), now, now))
+                conn.executemany("INSERT INTO chunks(job_id, idx, start_sec, end_sec) VALUES (?, ?, ?, ?)",
+                                 [(job_id, i, start_sec, end_sec) for i, (_, _, start_sec, end_sec) in enumerate(slice_list)])
+                self._import_progress_json(conn, job_id, output_text, segment_meta, meta)
+            if requeue is not None:
+                rows = conn.execute(
+                    "SELECT idx, start_sec, end_sec, text, device, elapsed, truncated, info FROM chunks WHERE job_id=? AND status='done'",
+                    (job_id,)).fetchall()
+                conn.executemany("UPDATE chunks SET status='pending' WHERE job_id=? AND idx=?",
+                                 [(job_id, row[0]) for row in rows if requeue(self._row_to_record(row[1:]))])
+        return StoreJob(self, job_id)
+
+    def _import_progress_json(self, conn, job_id, output_text, segment_meta, meta):
+        """匯入同一輸出的 JSON 進度檔（分段設定相同時），讓改用工作庫後可直接續跑。"""
+        progress = load_progress_json(output_text + PROGRESS_FILE_SUFFIX)
+        if "chunks" not in progress or _progress_segment_meta(progress.get("meta", {})) != segment_meta:
+            return
+        imported = 0
+        for idx_str, record in progress["chunks"].items():
+            if record.get("text"):
+                imported += conn.execute(
+                    "UPDATE chunks SET status='done', text=?, device=?, elapsed=?, truncated=?, info=?, finished_at=? WHERE job_id=? AND idx=?",
+                    (*self._record_values(record), time.time(), job_id, int(idx_str))).rowcount
+        for key in ("language", "language_confidence"):
+            if key in progress.get("meta", {}):
+                meta[key] = progress["meta"][key]
+        conn.execute("UPDATE jobs SET meta=? WHERE job_id=?", (json.dumps(meta, ensure_ascii=False), job_id))
+        if imported:
+            print(f"已從 JSON 進度檔匯入 {imported} 段已完成的結果")
+
+    @classmethod
+    def _record_values(cls, record):
+        info = {k: v for k, v in record.items() if k not in cls._RECORD_COLUMNS}
+        return (record["text"], record.get("device"), record.get("elapsed"), int(bool(record.get("truncated"))),
+                json.dumps(info, ensure_ascii=False) if info else None)
+
+    @staticmethod
+    def _row_to_record(row):
+        start_sec, end_sec, text, device, elapsed, truncated, info = row
+        record = {"start": start_sec, "end": end_sec, "text": text, "device": device, "elapsed": elapsed}
+        if truncated:
+            record["truncated"] = True
+        record.update(json.loads(info) if info else {})
+        return record
+
+    def stats(self):
+        """跨所有工作的彙總：工作狀態數量，以及各裝置的段落數、音訊秒數、耗時與 RTF。"""
+        with self._lock:
+            jobs = dict(self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            chunks = dict(self._conn.execute("SELECT status, COUNT(*) FROM chunks GROUP BY status").fetchall())
+            devices = self._conn.execute(
+                "SELECT COALESCE(device, 'unknown'), COUNT(*), SUM(end_sec - start_sec), SUM(elapsed) "
+                "FROM chunks WHERE status='done' AND elapsed IS NOT NULL GROUP BY 1 ORDER BY 2 DESC").fetchall()
+        return {
+            "jobs": jobs,
+            "chunks": chunks,
+            "devices": [{"device": d, "chunks": n, "audio_seconds": audio or 0.0, "elapsed": elapsed or 0.0,
+                         "rtf": (elapsed / audio) if audio else None} for d, n, audio, elapsed in devices],
+        }
+
+    def print_stats(self):
+        stats = self.stats()
+        print(f"工作庫：{self.path}")
+        print("工作：" + ("、".join(f"{k} {v}" for k, v in stats["jobs"].items()) or "（無）"))
+        print("段落：" + ("、".join(f"{k} {v}" for k, v in stats["chunks"].items()) or "（無）"))
+        for d in stats["devices"]:
+            rtf = f"{d['rtf']:.3f}" if d["rtf"] is not None else "—"
+            print(f"  {d['device']:>8}：{d['chunks']} 段，音訊 {_format_duration(d['audio_seconds'])}，耗時 {_format_duration(d['elapsed'])}，RTF {rtf}")
+
+
+class StoreJob:
+    """JobStore 中的單一工作，介面同 ProgressFile。"""
+
+    def __init__(self, store, job_id):
+        self.store = store
+        self.job_id = job_id
+        self.location = f"{store.path}（工作 {job_id}）"
+
+    @property
+    def meta(self):
+        with self.store._lock:
+            row = self.store._conn.execute("SELECT meta FROM jobs WHERE job_id=?", (self.job_id,)).fetchone()
+        return json.loads(row[0])
+
+    def set_meta(self, **values):
+        with self.store._transaction() as conn:
+            row = conn.execute("SELECT meta FROM jobs WHERE job_id=?", (self.job_id,)).fetchone()
+            meta = {**json.loads(row[0]), **values}
+            conn.execute("UPDATE jobs SET meta=?, updated=? WHERE job_id=?", (json.dumps(meta, ensure_ascii=False), time.time(), self.job_id))
+
+    def _claim_next(self):
+        now = time.time()
+        with self.store._transaction() as conn:
+            # 未領取的段落，或領取後超過租期仍未完成（worker 已中斷）的段落
+            row = conn.execute(
+                "SELECT idx FROM chunks WHERE job_id=? AND (status='pending' OR (status='running' AND claimed_at < ?)) ORDER BY idx LIMIT 1",
+                (self.job_id, now - self.store.lease_seconds)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE chunks SET status='running', worker=?, claimed_at=? WHERE job_id=? AND idx=?",
+                         (self.store.worker, now, self.job_id, row[0]))
+        return row[0]
+
+    def claim(self, n_total):
+        """逐一原子領取尚未完成的段落，直到沒有可領取的段落為止。"""
+        while True:
+            idx = self._claim_next()
+            if idx is None:
+                return
+            yield idx
+
+    def get(self, idx):
+        with self.store._lock:
+            row = self.store._conn.execute(
+                "SELECT start_sec, end_sec, text, device, elapsed, truncated, info FROM chunks WHERE job_id=? AND idx=?",
+                (self.job_id, idx)).fetchone()
+        return self.store._row_to_record(row) if row is not None and row[2] is not None else None
+
+    def save(self, idx, record):
+        with self.store._transaction() as conn:
+            conn.execute(
+                "UPDATE chunks SET status='done', text=?, device=?, elapsed=?, truncated=?, info=?, finished_at=? WHERE job_id=? AND idx=?",
+                (*self.store._record_values(record), time.time(), self.job_id, idx))
+
+    def keep(self, idx):
+        """保留既有結果（先前被重新排入佇列、但本次不重新解碼的段落）。"""
+        with self.store._transaction() as conn:
+            conn.execute("UPDATE chunks SET status='done' WHERE job_id=? AND idx=?", (self.job_id, idx))
+
+    def release(self, idx):
+        """取消或中斷時歸還領取的段落，讓其他 worker 立即可以領取。"""
+        with self.store._transaction() as conn:
+            conn.execute("UPDATE chunks SET status='pending', worker=NULL, claimed_at=NULL WHERE job_id=? AND idx=? AND status='running'",
+                         (self.job_id, idx))
+
+    def records(self):
+        with self.store._lock:
+            rows = self.store._conn.execute(
+                "SELECT idx, start_sec, end_sec, text, device, elapsed, truncated, info FROM chunks WHERE job_id=? AND text IS NOT NULL ORDER BY idx",
+                (self.job_id,)).fetchall()
+        return {row[0]: self.store._row_to_record(row[1:]) for row in rows}
+
+    def pending_count(self):
+        with self.store._lock:
+            return self.store._conn.execute("SELECT COUNT(*) FROM chunks WHERE job_id=? AND status!='done'", (self.job_id,)).fetchone()[0]
+
+    def finalize(self):
+        """所有段落完成且尚無其他 worker 在合併時回傳 True（由本 worker 寫出逐字稿）。"""
+        now = time.time()
+        with self.store._transaction() as conn:
+            unfinished = conn.execute("SELECT COUNT(*) FROM chunks WHERE job_id=? AND status!='done'", (self.job_id,)).fetchone()[0]
+            if unfinished:
+                return False
+            won = conn.execute(
+                "UPDATE jobs SET status='finalizing', updated=? WHERE job_id=? AND (status!='finalizing' OR updated < ?)",
+                (now, self.job_id, now - self.store.lease_seconds)).rowcount
+        return bool(won)
+
+    def finish(self):
+        with self.store._transaction() as conn:
+            conn.execute("UPDATE jobs SET status='done', updated=? WHERE job_id=?", (time.time(), self.job_id))
+
+
 def _suppress_noisy_warnings():
     """抑制常見但無害的第三方警告訊息（可選）。"""
     # torchaudio 的未來變更提醒
@@ -247,7 +1770,522 @@ def _suppress_noisy_warnings():
     hf_logging.set_verbosity_error()
 
 
-def main(input_audio, output_text, non_interactive=False, auto_clean_progress=False, language: Optional[str]=None, suppress_warnings: bool=False):
+def _dtype_supported(dtype, device):
+    """以小型運算試跑判斷裝置是否能以該精度執行（matmul / layer_norm / softmax / gelu）。"""
+    if dtype == torch.float32:
+        return True
+    if device.type == "cpu":
+        if dtype == torch.float16:
+            return False  # CPU 上 fp16 多數運算沒有加速，甚至不支援
+        # CPU bf16 需硬體原生支援（AVX512-BF16 / AMX），否則模擬運算反而更慢
+        try:
+            if not torch.ops.mkldnn._is_mkldnn_bf16_supported():
+                return False
+        except Exception:
+            return False
+    try:
+        x = torch.randn(8, 64, device=device, dtype=dtype)
+        w = torch.randn(64, 64, device=device, dtype=dtype)
+        y = torch.nn.functional.layer_norm(x @ w, (64,))
+        y = torch.nn.functional.gelu(torch.softmax(y, dim=-1))
+        return bool(torch.isfinite(y.float()).all())
+    except Exception:
+        return False
+
+def resolve_dtype(name, device):
+    """回傳 (精度名稱, torch.dtype)；裝置不支援所要求的精度時自動退回 fp32。"""
+    if name not in DTYPES:
+        raise ValueError(f"未知的精度：{name}（可用：{', '.join(DTYPES)}）")
+    if _dtype_supported(DTYPES[name], device):
+        return name, DTYPES[name]
+    print(f"⚠ {str(device).upper()} 不支援 {name} 推論，改用 fp32")
+    return "fp32", torch.float32
+
+def _select_device():
+    return torch.device("mps" if (torch.backends.mps.is_available() and torch.backends.mps.is_built()) else "cpu")
+
+def _file_sha256(path, block_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def _has_inference_files(model_dir):
+    if not model_dir or not os.path.isdir(model_dir):
+        return False
+    names = set(os.listdir(model_dir))
+    return all(name in names for name in REQUIRED_MODEL_FILES) and any(name.endswith(".safetensors") for name in names)
+
+def model_manifest_path(cache_dir=None):
+    """模型清單路徑：預設 HF 快取為 MODEL_MANIFEST_PATH；另外指定 cache_dir 時每個快取目錄各自一份，不會讀到其他快取的清單。"""
+    if cache_dir is None:
+        return MODEL_MANIFEST_PATH
+    key = hashlib.sha256(os.path.abspath(os.path.expanduser(cache_dir)).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(APP_CACHE_DIR, f"model_manifest-{key}.json")
+
+def write_model_manifest(model_dir, manifest_path=MODEL_MANIFEST_PATH):
+    """記錄本機模型目錄中每個檔案的大小與 SHA-256（僅首次或更新後計算一次）。"""
+    files = {}
+    for root, _, names in os.walk(model_dir):
+        for name in names:
+            full = os.path.join(root, name)
+            rel = os.path.relpath(full, model_dir).replace(os.sep, "/")
+            files[rel] = {"size": os.path.getsize(full), "sha256": _file_sha256(full)}
+    manifest = {
+        "repo_id": MODEL_ID,
+        # HF 快取的 snapshot 目錄名即為 commit hash
+        "revision": os.path.basename(os.path.normpath(model_dir)),
+        "path": os.path.abspath(model_dir),
+        "created": datetime.now().isoformat(),
+        "files": files,
+    }
+    save_progress_json(manifest_path, manifest)
+    return manifest
+
+def load_model_manifest(manifest_path=MODEL_MANIFEST_PATH):
+    manifest = load_progress_json(manifest_path)
+    return manifest if manifest.get("repo_id") == MODEL_ID else {}
+
+def _manifest_matches(manifest, verify_hashes=False):
+    """清單中的檔案都在且大小相符（verify_hashes=True 時再比對 SHA-256）。"""
+    model_dir = manifest.get("path")
+    if not manifest.get("files") or not _has_inference_files(model_dir):
+        return False
+    for rel, info in manifest["files"].items():
+        full = os.path.join(model_dir, rel)
+        if not os.path.isfile(full) or os.path.getsize(full) != info["size"]:
+            return False
+        if verify_hashes and _file_sha256(full) != info["sha256"]:
+            print(f"⚠ 模型檔雜湊不符：{rel}")
+            return False
+    return True
+
+def find_local_model(cache_dir=None, manifest_path=None, verify_hashes=False):
+    """
+    不連網尋找本機模型目錄：先比對清單，其次查 HF 快取（cache_dir，None 為 HF 預設位置；找到時補寫清單）。
+    manifest_path 未指定時為 model_manifest_path(cache_dir)。找不到或檔案不完整時回傳 None。
+    """
+    manifest_path = manifest_path or model_manifest_path(cache_dir)
+    manifest = load_model_manifest(manifest_path)
+    if manifest and _manifest_matches(manifest, verify_hashes=verify_hashes):
+        return manifest["path"]
+    try:
+        from huggingface_hub import snapshot_download
+        model_dir = snapshot_download(MODEL_ID, cache_dir=cache_dir, ignore_patterns=INFERENCE_IGNORE_PATTERNS, local_files_only=True)
+    except Exception:
+        return None
+    if not _has_inference_files(model_dir):
+        return None
+    print("ⓘ 建立本機模型清單（僅首次，需計算檔案雜湊）...")
+    write_model_manifest(model_dir, manifest_path)
+    return model_dir
+
+def _model_revision(model_path, cache_dir=None):
+    """
+    模型版本：HF 快照目錄名稱（與模型清單的 revision 相同）。
+    model_path 為 MODEL_ID（交由 transformers 下載）時，從 HF 快取（cache_dir）找出處理器檔所在的快照；找不到時回傳 None。
+    """
+    if model_path and os.path.isdir(str(model_path)):
+        return os.path.basename(os.path.normpath(str(model_path)))
+    try:
+        from huggingface_hub import try_to_load_from_cache
+        cached = try_to_load_from_cache(str(model_path), "preprocessor_config.json", cache_dir=cache_dir)
+    except Exception:
+        return None
+    return os.path.basename(os.path.dirname(cached)) if isinstance(cached, str) else None
+
+def resolve_model_path(update=False, cache_dir=None, manifest_path=None, verify_hashes=False):
+    """
+    離線優先解析模型位置，回傳可直接交給 from_pretrained 的本機路徑：
+    模型已在本機時完全不連網；只有檔案缺漏或 update=True 時才下載（並更新清單）。
+    cache_dir：HF 快取目錄（None 為 HF 預設位置）；manifest_path 未指定時為 model_manifest_path(cache_dir)。
+    """
+    manifest_path = manifest_path or model_manifest_path(cache_dir)
+    if not update:
+        model_dir = find_local_model(cache_dir=cache_dir, manifest_path=manifest_path, verify_hashes=verify_hashes)
+        if model_dir:
+            print(f"ⓘ 使用本機模型：{model_dir}")
+            return model_dir
+
+    if platform.system() == "Windows":
+        # Windows 上避免 snapshot_download 以免觸發符號連結/硬連結權限問題（WinError 1314）；
+        # 交由 transformers 自行下載，下次啟動時 find_local_model 會在快取中找到並建立清單
+        print("ⓘ Windows：由 transformers 自行下載模型檔（首次可能需較久）。")
+        return MODEL_ID
+
+    # 排除訓練檢查點，只下載推論需要的檔案（避免下載 15GB 訓練檔案）
+    print("⬇️ 下載模型檔（僅推論檔案）..." if not update else "⬇️ 檢查並更新模型檔...")
+    try:
+        from huggingface_hub import snapshot_download
+        model_dir = snapshot_download(MODEL_ID, cache_dir=cache_dir, ignore_patterns=INFERENCE_IGNORE_PATTERNS, local_files_only=False)
+    except Exception as e:
+        print(f"⚠ 下載模型（忽略訓練檔）失敗：{e}，改用 transformers 直接載入。")
+        return MODEL_ID
+    write_model_manifest(model_dir, manifest_path)
+    return model_dir
+
+
+class TranscriptionEngine:
+    """
+    常駐轉錄引擎：模型只載入一次，跨多次轉換重用（GUI 在視窗開啟時即於背景預載）。
+    同一時間只允許一個轉換使用模型。
+    """
+    def __init__(self, backend="torch", device=None, dtype="fp32", update_model=False, verify_model=False, encoder_cache_mb=None, model_cache_dir=None, manifest_path=None):
+        if backend not in BACKENDS:
+            raise ValueError(f"未知的推論後端：{backend}（可用：{', '.join(BACKENDS)}）")
+        if dtype not in DTYPES:
+            raise ValueError(f"未知的精度：{dtype}（可用：{', '.join(DTYPES)}）")
+        self.backend = backend
+        self.requested_device = device  # None 表示自動選擇（MPS 優先）
+        self.requested_dtype = dtype
+        self.dtype_name = "fp32"  # 實際採用的精度（不支援時會退回 fp32）
+        self.update_model = update_model  # True 時才連網檢查模型更新
+        self.verify_model = verify_model  # True 時比對模型檔 SHA-256
+        self.encoder_cache_mb = encoder_cache_mb  # 指定時啟用磁碟 encoder 輸出快取（大小上限 MB）
+        self.encoder_cache = None
+        self.model_cache_dir = model_cache_dir  # HF 模型快取目錄（None 為 HF 預設位置）
+        self.manifest_path = manifest_path  # 模型清單路徑（None 依 model_cache_dir 決定）
+        self.model_path = None
+        self.processor = None
+        self.model = None
+        self.model_cpu = None  # 延遲初始化並重用 CPU 模型（僅在 MPS 失敗時需要）
+        self.device = None
+        self._load_lock = threading.Lock()
+        self._run_lock = threading.Lock()
+        # 資料夾模式下排程執行緒與各工作執行緒輪流使用模型（MPS 上多執行緒同時推論不安全）
+        self.model_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def is_ready(self):
+        return self.model is not None
+
+    @property
+    def model_revision(self):
+        """模型版本：HF 快照目錄名稱（與模型清單的 revision 相同）；無法判斷時為 None。"""
+        return _model_revision(self.model_path, cache_dir=self.model_cache_dir)
+
+    def load(self):
+        """同步載入模型與處理器（已載入則直接返回）。"""
+        with self._load_lock:
+            if self.model is not None:
+                return
+            try:
+                print("載入 Breeze-ASR-25 模型與處理器...")
+                self.model_path = resolve_model_path(update=self.update_model, cache_dir=self.model_cache_dir,
+                                                     manifest_path=self.manifest_path, verify_hashes=self.verify_model)
+                processor = WhisperProcessor.from_pretrained(self.model_path, cache_dir=self.model_cache_dir)
+                if self.backend == "onnx":
+                    # ONNX Runtime 後端固定於 CPU、fp32 執行
+                    device = torch.device("cpu")
+                    print("使用裝置：", device, "（ONNX Runtime）")
+                    if self.requested_dtype != "fp32":
+                        print(f"⚠ ONNX 後端僅支援 fp32，忽略 --dtype {self.requested_dtype}")
+                    # 匯出檔依模型版本分目錄：--update-model 換成新快照後會重新匯出，不會沿用舊權重
+                    revision = self.model_revision
+                    if revision:
+                        model = OnnxWhisperBackend.load_or_export(os.path.join(ONNX_CACHE_DIR, revision), model_path=self.model_path, cache_dir=self.model_cache_dir)
+                    else:
+                        print("⚠ 無法判斷模型版本，重新匯出 ONNX 模型（不沿用快取）")
+                        model = OnnxWhisperBackend.load_or_export(os.path.join(ONNX_CACHE_DIR, "unversioned"), model_path=self.model_path, force=True, cache_dir=self.model_cache_dir)
+                else:
+                    device = torch.device(self.requested_device) if self.requested_device else _select_device()
+                    print("使用裝置：", device)
+                    model = self._load_torch_model(device)
+                self.processor, self.device, self.model = processor, device, model
+                if self.encoder_cache_mb:
+                    # 快取鍵須含模型版本，否則更新模型後會讀到舊權重算出的 encoder 輸出
+                    revision = self.model_revision
+                    if revision:
+                        self.encoder_cache = EncoderCache(max_mb=self.encoder_cache_mb, namespace=f"{revision}/{self.backend}/{self.dtype_name}")
+                        print(f"encoder 輸出快取：{self.encoder_cache.cache_dir}（上限 {self.encoder_cache_mb:g}MB）")
+                    else:
+                        print("⚠ 無法判斷模型版本，停用 encoder 輸出快取")
+            finally:
+                self._ready.set()
+
+    def _load_torch_model(self, device):
+        # 權重直接以目標精度載入（不先載 fp32 再轉換，避免記憶體尖峰）
+        dtype_name, torch_dtype = resolve_dtype(self.requested_dtype, device)
+        model = WhisperForConditionalGeneration.from_pretrained(self.model_path, dtype=torch_dtype, cache_dir=self.model_cache_dir).to(device).eval()
+        weight_gb = sum(p.numel() * p.element_size() for p in model.parameters()) / _GB
+        print(f"推論精度：{dtype_name}（權重 {weight_gb:.1f}GB）")
+        if str(device) == str(self.device) or self.device is None:
+            self.dtype_name = dtype_name
+        return model
+
+    def start_loading(self):
+        """於背景執行緒預載模型（不阻塞呼叫端）。"""
+        if self.model is not None or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._ready.clear()
+        self._thread = threading.Thread(target=self._load_in_background, daemon=True)
+        self._thread.start()
+
+    def _load_in_background(self):
+        try:
+            self.load()
+        except Exception as e:
+            print(f"⚠ 背景載入模型失敗：{e}")
+            traceback.print_exc()
+
+    def wait_ready(self, cancel_event=None, poll_seconds=0.2):
+        """等待背景預載完成；若未曾預載或預載失敗，則於目前執行緒同步載入。"""
+        if self._thread is not None:
+            while not self._ready.wait(poll_seconds):
+                if cancel_event is not None and cancel_event.is_set():
+                    raise TranscriptionCancelled()
+        if self.model is None:
+            self.load()
+
+    def get_cpu_model(self):
+        if str(self.device) == "cpu":
+            return self.model
+        with self._load_lock:
+            if self.model_cpu is None:
+                # 沿用已解析的本機模型路徑；CPU 不支援的精度會自動退回 fp32
+                self.model_cpu = self._load_torch_model(torch.device("cpu"))
+        return self.model_cpu
+
+    def transcribe(self, input_audio, output_text, cancel_event=None, **kwargs):
+        """以已載入的模型轉錄單一檔案；參數同 main()。"""
+        self.wait_ready(cancel_event=cancel_event)
+        with self._run_lock:
+            return main(input_audio, output_text, engine=self, cancel_event=cancel_event, **kwargs)
+
+
+class _ChunkRequest:
+    __slots__ = ("segment", "job_id", "forced_decoder_ids", "key", "future", "submitted")
+
+    def __init__(self, segment, job_id, forced_decoder_ids):
+        self.segment = segment
+        self.job_id = job_id
+        self.forced_decoder_ids = forced_decoder_ids
+        # 只有解碼提示相同（語言/任務）的段落能共用一次 generate
+        self.key = tuple(map(tuple, forced_decoder_ids)) if forced_decoder_ids is not None else None
+        self.future = Future()
+        self.submitted = time.time()
+
+
+class BatchScheduler:
+    """
+    跨檔案動態批次排程器：收集多個進行中工作的待轉錄段落，
+    湊滿 batch_size 或最舊的段落已等待 max_wait 秒時，送出一次 generate，
+    再把各列結果透過 Future 送回對應的工作。
+    """
+    def __init__(self, engine, batch_size=BATCH_SIZE, max_wait=MAX_BATCH_WAIT, cancel_event=None, governor=None):
+        self.engine = engine
+        self.governor = governor or MEMORY_GOVERNOR
+        self.batch_size = max(1, int(batch_size))
+        self.max_wait = max_wait
+        self.cancel_event = cancel_event
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = None
+        # 統計：批次數、段落數、每批實際填充數、各工作的等待與延遲
+        self.batch_fills = []
+        self.batch_elapsed = []
+        self.job_stats = {}
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit(self, segment, job_id, forced_decoder_ids=None):
+        req = _ChunkRequest(segment, job_id, forced_decoder_ids)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("BatchScheduler 已關閉")
+            self._pending.append(req)
+            self._cond.notify_all()
+        return req.future
+
+    def transcribe(self, segment, job_id, forced_decoder_ids=None):
+        """送出段落並等待結果，回傳 (text, device, elapsed, info)，語意同 transcribe_chunk_generate。"""
+        return self.submit(segment, job_id, forced_decoder_ids).result()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending and not self._closed:
+                self._cond.wait()
+            if not self._pending:
+                return None
+            oldest = self._pending[0]
+            deadline = oldest.submitted + self.max_wait
+            # 記憶體吃緊時縮小本批上限
+            limit = self.governor.batch_limit(self.batch_size)
+            while True:
+                same_key = [r for r in self._pending if r.key == oldest.key]
+                remaining = deadline - time.time()
+                if len(same_key) >= limit or remaining <= 0 or self._closed:
+                    break
+                self._cond.wait(remaining)
+            batch = same_key[:limit]
+            for req in batch:
+                self._pending.remove(req)
+            return batch
+
+    def _fail_pending(self, exc):
+        with self._cond:
+            pending, self._pending = self._pending, []
+        for req in pending:
+            req.future.set_exception(exc)
+
+    def _run(self):
+        processor, model, device = self.engine.processor, self.engine.model, self.engine.device
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            dispatched = time.time()
+            try:
+                with self.engine.model_lock:
+                    texts, infos, elapsed = transcribe_batch_generate(
+                        [r.segment for r in batch], processor, model, device,
+                        forced_decoder_ids=batch[0].forced_decoder_ids, cancel_event=self.cancel_event,
+                        encoder_cache=self.engine.encoder_cache,
+                    )
+                results = [(t, str(device), elapsed, info) for t, info in zip(texts, infos)]
+            except TranscriptionCancelled as e:
+                for req in batch:
+                    req.future.set_exception(e)
+                self._fail_pending(e)
+                continue
+            except Exception as e:
+                # 與 transcribe_chunk_generate 相同：失敗回傳空字串，交由呼叫端決定是否改用 CPU 重試
+                print(f"BatchScheduler 批次推論例外（device={device}）：{e}")
+                traceback.print_exc()
+                elapsed = None
+                results = [("", str(device), None, {"truncated": False}) for _ in batch]
+            self.governor.maybe_collect()
+
+            done = time.time()
+            self.batch_fills.append(len(batch))
+            if elapsed is not None:
+                self.batch_elapsed.append(elapsed)
+            print(f"批次推論：{len(batch)}/{self.batch_size} 段（{len({r.job_id for r in batch})} 個檔案），耗時 {elapsed or 0:.1f} 秒")
+            for req, result in zip(batch, results):
+                stats = self.job_stats.setdefault(req.job_id, {"chunks": 0, "queue_wait": 0.0, "latency": 0.0})
+                stats["chunks"] += 1
+                stats["queue_wait"] += dispatched - req.submitted
+                stats["latency"] += done - req.submitted
+                req.future.set_result(result)
+
+    def report(self):
+        """列印批次填充率與各工作延遲統計。"""
+        if not self.batch_fills:
+            print("批次統計：沒有執行任何批次")
+            return
+        n_batches = len(self.batch_fills)
+        n_chunks = sum(self.batch_fills)
+        avg_fill = n_chunks / (n_batches * self.batch_size)
+        print(f"批次統計：{n_batches} 批 / {n_chunks} 段，平均填充率 {avg_fill:.0%}（目標 {self.batch_size}）")
+        if self.batch_elapsed:
+            print(f"  平均每批推論 {sum(self.batch_elapsed)/len(self.batch_elapsed):.1f} 秒")
+        for job_id, stats in self.job_stats.items():
+            n = stats["chunks"]
+            print(f"  {os.path.basename(job_id)}：{n} 段，平均等待 {stats['queue_wait']/n:.2f} 秒，平均段落延遲 {stats['latency']/n:.1f} 秒")
+
+
+def transcribe_files_batched(jobs, engine=None, batch_size=None, max_wait=MAX_BATCH_WAIT, max_jobs=None, cancel_event=None, **main_kwargs):
+    """
+    同時處理多個檔案，所有工作的段落經 BatchScheduler 共用 generate 批次。
+    jobs 為 [(input_audio, output_text), ...]；其餘參數同 main()。
+    batch_size 未指定時使用本機調校設定（autotune，後端與精度相同時），否則為 BATCH_SIZE。
+    回傳 {output_text: 工作總耗時（秒）或 None（失敗）}。
+    """
+    if engine is None:
+        engine = TranscriptionEngine()
+    engine.wait_ready(cancel_event=cancel_event)
+    if batch_size is None:
+        batch_size = host_profile_tuning(load_host_profile(), engine.backend, engine.dtype_name).get("batch_size", BATCH_SIZE)
+    # 依可用記憶體決定批次大小與同時工作數（預設工作數為批次的兩倍，才湊得滿）
+    batch_size, max_jobs = MEMORY_GOVERNOR.plan(batch_size, max_jobs)
+    print(f"跨檔案動態批次：batch={batch_size}，同時 {max_jobs} 個工作，最久等待 {max_wait}s")
+    scheduler = BatchScheduler(engine, batch_size=batch_size, max_wait=max_wait, cancel_event=cancel_event).start()
+    job_latency = {}
+
+    def _run_job(input_audio, output_text):
+        job_start = time.time()
+        try:
+            main(input_audio, output_text, engine=engine, cancel_event=cancel_event, scheduler=scheduler, non_interactive=True, **main_kwargs)
+            job_latency[output_text] = time.time() - job_start
+        except (TranscriptionCancelled, InsufficientMemoryError):
+            job_latency[output_text] = None
+            raise
+        except Exception as e:
+            print(f"⚠ 工作失敗（{input_audio}）：{e}")
+            traceback.print_exc()
+            job_latency[output_text] = None
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_jobs) as pool:
+            futures = [pool.submit(_run_job, inp, out) for inp, out in jobs]
+            for fut in futures:
+                fut.result()
+    finally:
+        scheduler.close()
+        scheduler.report()
+    for output_text, latency in job_latency.items():
+        status = f"{_format_duration(latency)}（{latency:.1f} 秒）" if latency is not None else "失敗"
+        print(f"工作延遲：{os.path.basename(output_text)} → {status}")
+    return job_latency
+
+
+def _cli_stream_printer():
+    """
+    命令列串流顯示的 stream_callback：終端機上部分文字以 \\r 覆寫同一行，
+    段落完成後印出去除重疊後的最終文字；非終端機（重導向）時只印最終文字。
+    """
+    is_tty = sys.stdout.isatty()
+    # 中文字佔兩格，保守以欄寬一半作為可顯示字數
+    max_chars = max(10, shutil.get_terminal_size((100, 20)).columns // 2 - 4)
+
+    def _callback(idx, text, final):
+        if final:
+            print(f"📝 {text}")
+        elif is_tty:
+            line = "" if text is None else "⋯ " + (text if len(text) <= max_chars else "…" + text[-max_chars:])
+            sys.stdout.write("\r\033[K" + line)
+            sys.stdout.flush()
+    return _callback
+
+def _collect_audio_jobs(input_dir, output_dir):
+    """列出資料夾內的音檔，輸出為 <output_dir>/<檔名>_transcript.txt（與 GUI 相同命名）。"""
+    jobs = []
+    for name in sorted(os.listdir(input_dir)):
+        if name.lower().endswith(AUDIO_EXTENSIONS):
+            stem = os.path.splitext(name)[0]
+            jobs.append((os.path.join(input_dir, name), os.path.join(output_dir, f"{stem}_transcript.txt")))
+    return jobs
+
+
+
+def main(input_audio, output_text, non_interactive=False, auto_clean_progress=False, language: Optional[str]=None, suppress_warnings: bool=False, engine: Optional[TranscriptionEngine]=None, cancel_event: Optional[threading.Event]=None, redecode_truncated: bool=False, scheduler: Optional["BatchScheduler"]=None, profile: bool=False, profile_chunks: Optional[tuple]=None, stream_callback=None, detect_file_language: bool=True, segmentation: Optional[str]=None, chunk_seconds: Optional[float]=None, overlap_seconds: Optional[float]=None, store: Optional[JobStore]=None, num_threads: Optional[int]=None, split_channels: bool=False, second_pass: bool=False):
+    """
+    轉錄單一音檔並寫出逐字稿（支援進度檔續跑）。
+    stream_callback(idx, text, final)：逐 token 回報第 idx 段的部分文字（final=False，text 為 None 表示本段生成結束），
+    段落完成時回報去除重疊後的最終文字（final=True）。
+    未指定 language 時，預設先對全檔做一次語言偵測並套用到每一段（detect_file_language=False 則改為每段各自偵測）。
+    segmentation："fixed"（固定長度 + 重疊）或 "silence"（切點對齊低能量處，重疊縮短）。
+    split_channels：多聲道錄音（例如客服電話的客戶 / 專員各一聲道）各聲道分開轉錄，同一段的各聲道共用一次 generate，
+    輸出依段落時間交錯並標上聲道；單聲道音檔則照常轉錄。
+    second_pass：每段記錄平均 token log 機率與壓縮比，低信心或被截斷的段落再以 beam search / 取樣重新解碼（續跑時也會補做）。
+    分段設定未指定時：續跑沿用進度中的設定，新工作套用 autotune 產生的本機設定檔，沒有設定檔則為 fixed / 30s / 3s。
+    num_threads 未指定時，本機設定檔與目前引擎的後端 / 精度相同才套用，否則為 PyTorch 預設執行緒數。
+    store：指定 JobStore 時進度改存於 SQLite 工作庫，可與其他 worker 同時處理同一檔案（預設為 JSON 進度檔）。
+    """
     if suppress_warnings:
         _suppress_noisy_warnings()
 
@@ -255,43 +2293,45 @@ def main(input_audio, output_text, non_interactive=False, auto_clean_progress=Fa
     input_audio = os.path.expanduser(input_audio)
     output_text = os.path.expanduser(output_text)
 
+    # 未明確指定分段設定時（三者皆未指定才整組套用）：續跑沿用進度中的設定，否則段落索引對不上、已完成的段落會被捨棄；
+    # 新工作才改用 autotune 的本機設定
+    host_profile = load_host_profile()
+    if segmentation is None and chunk_seconds is None and overlap_seconds is None:
+        resumed = resumable_segment_settings(output_text, store)
+        if resumed is not None:
+            segmentation, chunk_seconds, overlap_seconds = resumed
+        elif "segmentation" in host_profile:
+            segmentation, chunk_seconds, overlap_seconds = host_profile["segmentation"], host_profile["chunk_seconds"], host_profile["overlap_seconds"]
+            print(f"ⓘ 套用本機調校設定（{segmentation} {chunk_seconds:g}s/{overlap_seconds:g}s）← {host_profile_path()}")
+    segmentation = segmentation or "fixed"
 
     total_start = time.time()
     check_system_requirements()
-    print("載入 Breeze-ASR-25 模型與處理器...")
-
-    # 排除訓練檢查點，只載入推論需要的檔案（避免下載 15GB 訓練檔案）
-    # 注意：from_pretrained 不支援 ignore_patterns，需先用 snapshot_download 過濾（非 Windows）
-    inference_ignore_patterns = [
-        "*.bin",
-        "*.pkl",
-        "checkpoint-*",
-        "*.ckpt",
-        "*.pth",
-        "*.pt",
-        "whisper-github/*",
-    ]
-
-    is_windows = (platform.system() == "Windows")
-    if not is_windows:
-        try:
-            from huggingface_hub import snapshot_download
-            snapshot_download(
-                "MediaTek-Research/Breeze-ASR-25",
-                ignore_patterns=inference_ignore_patterns,
-                local_files_only=False
-            )
-        except Exception as e:
-            print(f"⚠ 預抓取模型（忽略訓練檔）失敗：{e}，改用 transformers 直接載入。")
+    if engine is None:
+        engine = TranscriptionEngine()
+    if engine.is_ready:
+        print("ⓘ 使用已載入的 Breeze-ASR-25 模型（常駐引擎）")
     else:
-        # Windows 上避免 snapshot_download 以免觸發符號連結/硬連結權限問題（WinError 1314）
-        print("ⓘ Windows：由 transformers 自行下載模型檔（首次可能需較久）。")
-    
-    processor = WhisperProcessor.from_pretrained("MediaTek-Research/Breeze-ASR-25")
-    device = torch.device("mps" if (torch.backends.mps.is_available() and torch.backends.mps.is_built()) else "cpu")
-    print("使用裝置：", device)
-    model = WhisperForConditionalGeneration.from_pretrained("MediaTek-Research/Breeze-ASR-25").to(device).eval()
-    model_cpu = None  # 延遲初始化並重用 CPU 模型（僅在需要時）
+        engine.wait_ready(cancel_event=cancel_event)
+    # 執行緒數的最佳值取決於後端與精度，需等引擎載入後才知道是否與本機設定的量測條件相同
+    if num_threads is None:
+        num_threads = host_profile_tuning(host_profile, engine.backend, engine.dtype_name).get("threads")
+        if num_threads:
+            print(f"ⓘ 套用本機調校設定（threads {num_threads}）← {host_profile_path()}")
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    processor, model, device = engine.processor, engine.model, engine.device
+    encoder_cache = engine.encoder_cache
+    # 資料夾模式：排程執行緒同時在使用模型，本執行緒直接推論（語言偵測、重新解碼、CPU 重試）時需輪流
+    model_lock = engine.model_lock if scheduler is not None else None
+    model_guard = model_lock or nullcontext()
+    cache_hits, cache_misses = (encoder_cache.hits, encoder_cache.misses) if encoder_cache is not None else (0, 0)
+    if redecode_truncated and engine.backend == "onnx":
+        print("⚠ ONNX 後端僅支援 greedy 解碼，略過 --redecode-truncated")
+        redecode_truncated = False
+    if second_pass and engine.backend == "onnx":
+        print("⚠ ONNX 後端僅支援 greedy 解碼，略過 --second-pass")
+        second_pass = False
     forced_decoder_ids = None
     if language:
         try:
@@ -309,60 +2349,218 @@ def main(input_audio, output_text, non_interactive=False, auto_clean_progress=Fa
     file_size_mb = os.path.getsize(input_audio) / (1024**2)
     if file_size_mb > 500:
         print(f"⚠️  音檔較大（{file_size_mb:.1f}MB），可能需要較多記憶體")
-    arr_full, sr = load_and_prepare(input_audio, target_sr=SR)
-    total_samples = arr_full.shape[0]
-    slice_list = compute_slices_with_overlap(total_samples, sr, CHUNK_SECONDS, OVERLAP_SECONDS)
+    profiler = None
+    if profile:
+        first_chunk, last_chunk = profile_chunks or (0, 0)
+        profiler = ChunkProfiler(output_text, model, first_chunk, last_chunk)
+        if first_chunk == 0:
+            # 從第一段開始分析時，一併涵蓋音檔讀取與重採樣
+            profiler.start()
+    arr_full, sr = load_and_prepare(input_audio, target_sr=SR, keep_channels=split_channels)
+    channels = None  # 聲道分開模式：(channels, samples)；分段與語言偵測仍以混音進行，切點各聲道共用
+    if arr_full.ndim == 2:
+        channels, arr_full = arr_full, arr_full.mean(axis=0)
+        print(f"聲道分開模式：{channels.shape[0]} 個聲道，同一段的各聲道批次轉錄")
+    elif split_channels:
+        print("ⓘ 音檔為單聲道，照常轉錄")
+    chunk_seconds = chunk_seconds or CHUNK_SECONDS
+    if overlap_seconds is None:
+        overlap_seconds = SNAP_OVERLAP_SECONDS if segmentation == "silence" else OVERLAP_SECONDS
+    slice_list = compute_slices(arr_full, sr, segmentation, chunk_seconds, overlap_seconds)
     if not slice_list:
         print("分段失敗，結束")
+        if profiler is not None:
+            profiler.stop()
         return
 
-    prog_path = output_text + PROGRESS_FILE_SUFFIX
-    progress = load_progress_json(prog_path)
-    # progress format: { "chunks": { idx_str: {"start":..., "end":..., "text":..., "device":..., "elapsed":... } }, "meta": {...} }
-    if "chunks" not in progress:
-        progress = {"chunks": {}, "meta": {"input_audio": input_audio, "created": datetime.now().isoformat()}}
+    def _needs_redecode(record):
+        """已完成的段落是否要重新處理："failed"（先前推論失敗）、"truncated"（以取樣重新解碼）、"second_pass"（補做第二階段）或 None。"""
+        if record.get("text") == FAILED_CHUNK_TEXT:
+            return "failed"
+        if redecode_truncated and record.get("truncated") and not record.get("second_pass"):
+            return "truncated"
+        if second_pass and needs_second_pass(record) and not record.get("second_pass"):
+            return "second_pass"
+        return None
+
+    segment_meta = {"segmentation": segmentation, "chunk_seconds": chunk_seconds, "overlap_seconds": overlap_seconds,
+                    "channels": channels.shape[0] if channels is not None else 1}
+    if store is not None:
+        progress = store.open_job(output_text, input_audio, slice_list, segment_meta, requeue=lambda record: _needs_redecode(record) is not None)
+    else:
+        progress = ProgressFile(output_text, input_audio, segment_meta)
+
+    # 檔案層級語言偵測：只做一次，所有段落共用同一組 forced_decoder_ids（續跑時沿用進度檔中的結果）
+    if forced_decoder_ids is None and detect_file_language:
+        detected = progress.meta.get("language")
+        if detected:
+            print(f"沿用先前偵測的語言：{detected}")
+        else:
+            try:
+                window_idx = pick_speech_windows(arr_full, slice_list)
+                windows = [arr_full[slice_list[i][0]:slice_list[i][1]] for i in window_idx]
+                with model_guard:
+                    detected, confidence, _ = detect_language(windows, processor, model, device)
+                print(f"語言偵測：{detected}（信心 {confidence:.0%}，取樣第 {', '.join(str(i+1) for i in window_idx)} 段）")
+                if confidence < LANGUAGE_MIN_CONFIDENCE:
+                    print(f"⚠ 語言偵測信心偏低（{confidence:.0%} < {LANGUAGE_MIN_CONFIDENCE:.0%}），仍以 {detected} 轉錄；若結果不正確請以 --language 指定")
+                progress.set_meta(language=detected, language_confidence=confidence)
+            except Exception as e:
+                print(f"⚠ 檔案層級語言偵測失敗：{e}，改為每段各自偵測")
+                detected = None
+        if detected:
+            forced_decoder_ids = processor.get_decoder_prompt_ids(language=detected, task="transcribe")
 
-    results_ordered = []
     n_total = len(slice_list)
-    for idx, (start_sample, end_sample, start_sec, end_sec) in enumerate(slice_list):
-        idx_str = str(idx)
-        if idx_str in progress["chunks"] and progress["chunks"][idx_str].get("text"):
-            print(f"跳過第 {idx+1}/{n_total} 段（已完成）")
-            results_ordered.append((idx, progress["chunks"][idx_str]["text"], progress["chunks"][idx_str].get("device","unknown")))
-            continue
+    current_idx = None  # 目前領取中的段落（取消時歸還給工作庫）
+
+    running_text = ""  # 依序合併的文字，用來計算每段去除重疊後新增的部分（串流顯示用）
+    stream_merger = ChannelMerger() if channels is not None else None
+
+    def _commit_stream(idx, record):
+        nonlocal running_text
+        if stream_callback is None:
+            return
+        if stream_merger is not None:
+            delta = stream_merger.add(record.get("channels", []))
+        else:
+            running_text, delta = _merge_delta(running_text, record["text"])
+        if delta:
+            stream_callback(idx, delta, True)
+
+    try:
+        for idx in progress.claim(n_total):
+            current_idx = idx
+            start_sample, end_sample, start_sec, end_sec = slice_list[idx]
+            if cancel_event is not None and cancel_event.is_set():
+                raise TranscriptionCancelled()
+            # 記憶體不足時停止並保留進度，而非被系統 OOM 終止
+            MEMORY_GOVERNOR.check()
+            generate_overrides = None
+            first_pass = None  # 只需補做第二階段時，沿用先前的第一階段結果
+            record = progress.get(idx)
+            if record is not None:
+                redecode = _needs_redecode(record)
+                if redecode == "failed":
+                    print(f"重新轉錄第 {idx+1}/{n_total} 段（先前推論失敗）...")
+                elif redecode == "truncated" and not second_pass:
+                    # 先前因重複迴圈被截斷的段落：改用取樣重新解碼
+                    print(f"重新解碼第 {idx+1}/{n_total} 段（先前偵測到重複迴圈）...")
+                    generate_overrides = {"do_sample": True, "temperature": REDECODE_TEMPERATURE}
+                elif redecode is not None:
+                    print(f"第二階段：重新解碼第 {idx+1}/{n_total} 段（低信心）...")
+                    first_pass = record
+                else:
+                    print(f"跳過第 {idx+1}/{n_total} 段（已完成）")
+                    progress.keep(idx)
+                    current_idx = None
+                    _commit_stream(idx, record)
+                    continue
 
-        print(f"轉錄第 {idx+1}/{n_total} 段... ({start_sec:.1f}s - {end_sec:.1f}s)")
-        seg = arr_full[start_sample:end_sample]
-        txt, used_dev, elapsed = transcribe_chunk_generate(seg, processor, model, device, forced_decoder_ids=forced_decoder_ids)
-        if (not txt.strip()) and (str(device) != "cpu"):
-            print("在 MPS 上失敗或無結果，嘗試用 CPU 重試一次...")
-            cpu_device = torch.device("cpu")
-            if model_cpu is None:
-                # 延遲初始化 CPU 模型並重用（已由 snapshot_download 過濾訓練檔案）
-                model_cpu = WhisperForConditionalGeneration.from_pretrained("MediaTek-Research/Breeze-ASR-25").to(cpu_device).eval()
-            txt_cpu, used_dev_cpu, elapsed_cpu = transcribe_chunk_generate(seg, processor, model_cpu, cpu_device, forced_decoder_ids=forced_decoder_ids)
-            if txt_cpu.strip():
-                txt = txt_cpu
-                used_dev = used_dev_cpu
-                elapsed = elapsed_cpu
-
-        if not txt:
-            txt = "[無法轉錄]"
-
-        # save into progress
-        progress["chunks"][idx_str] = {"start": start_sec, "end": end_sec, "text": txt, "device": used_dev, "elapsed": elapsed}
-        save_progress_json(prog_path, progress)
-        results_ordered.append((idx, txt, used_dev))
-
-    # 合併所有段落並處理重疊去重
-    # 先按 index 排序
-    results_ordered.sort(key=lambda x: x[0])
+            print(f"轉錄第 {idx+1}/{n_total} 段... ({start_sec:.1f}s - {end_sec:.1f}s)")
+            if profiler is not None and profiler.covers(idx):
+                profiler.start()
+            seg = arr_full[start_sample:end_sample]
+            on_partial = (lambda text, _idx=idx: stream_callback(_idx, text, False)) if stream_callback is not None else None
+            if channels is not None:
+                channel_segs = [ch[start_sample:end_sample] for ch in channels]
+            if first_pass is not None:
+                used_dev, elapsed = first_pass.get("device", "unknown"), first_pass.get("elapsed")
+                if channels is not None:
+                    channel_texts = first_pass.get("channels", [])
+                    channel_infos = first_pass.get("channel_infos") or [{"truncated": False} for _ in channel_texts]
+                else:
+                    txt = first_pass["text"]
+                    chunk_info = {k: v for k, v in first_pass.items() if k not in ("start", "end", "text", "device", "elapsed")}
+            elif channels is not None:
+                channel_texts, used_dev, elapsed, channel_infos = transcribe_channels(channel_segs, processor, model, device, forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, generate_overrides=generate_overrides, scheduler=scheduler, job_id=output_text, encoder_cache=encoder_cache, model_lock=model_lock)
+                if not any(channel_texts) and str(device) != "cpu":
+                    print("在 MPS 上失敗或無結果，嘗試用 CPU 重試一次...")
+                    retry = transcribe_channels(channel_segs, processor, engine.get_cpu_model(), torch.device("cpu"), forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, generate_overrides=generate_overrides, model_lock=model_lock)
+                    if any(retry[0]):
+                        channel_texts, used_dev, elapsed, channel_infos = retry
+            elif scheduler is not None and generate_overrides is None:
+                # 跨檔案動態批次：與其他工作的段落共用一次 generate
+                txt, used_dev, elapsed, chunk_info = scheduler.transcribe(seg, job_id=output_text, forced_decoder_ids=forced_decoder_ids)
+            else:
+                chunk_info = {}
+                with model_guard:
+                    txt, used_dev, elapsed = transcribe_chunk_generate(seg, processor, model, device, forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, chunk_info=chunk_info, generate_overrides=generate_overrides, on_partial=on_partial, encoder_cache=encoder_cache)
+            if first_pass is None and channels is None and (not txt.strip()) and (str(device) != "cpu"):
+                print("在 MPS 上失敗或無結果，嘗試用 CPU 重試一次...")
+                cpu_device = torch.device("cpu")
+                model_cpu = engine.get_cpu_model()
+                chunk_info_cpu = {}
+                with model_guard:
+                    txt_cpu, used_dev_cpu, elapsed_cpu = transcribe_chunk_generate(seg, processor, model_cpu, cpu_device, forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, chunk_info=chunk_info_cpu, generate_overrides=generate_overrides)
+                if txt_cpu.strip():
+                    txt = txt_cpu
+                    used_dev = used_dev_cpu
+                    elapsed = elapsed_cpu
+                    chunk_info = chunk_info_cpu
+
+            # 第二階段：只重新解碼低信心的段落（聲道分開模式則為低信心的聲道）
+            if second_pass and channels is not None:
+                with model_guard:
+                    channel_texts, channel_infos = second_pass_decode(channel_segs, processor, model, device, channel_texts, channel_infos, forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, encoder_cache=encoder_cache)
+            elif second_pass and txt.strip():
+                with model_guard:
+                    (txt,), (chunk_info,) = second_pass_decode([seg], processor, model, device, [txt], [chunk_info], forced_decoder_ids=forced_decoder_ids, cancel_event=cancel_event, encoder_cache=encoder_cache)
+            if channels is not None:
+                txt = "\n".join(f"[聲道{c+1}] {t}" for c, t in enumerate(channel_texts) if t)
+                chunk_info = _channel_chunk_info(channel_texts, channel_infos)
+
+            if not txt:
+                txt = FAILED_CHUNK_TEXT
+
+            # save into progress（truncated 段落可用 --redecode-truncated 重新解碼）
+            record = {"start": start_sec, "end": end_sec, "text": txt, "device": used_dev, "elapsed": elapsed, **chunk_info}
+            progress.save(idx, record)
+            current_idx = None
+            _commit_stream(idx, record)
+            # 分析範圍涵蓋最後一段時，延後到合併完成再停止
+            if profiler is not None and idx >= profiler.last_chunk and idx < n_total - 1:
+                profiler.stop()
+    except TranscriptionCancelled:
+        if profiler is not None:
+            profiler.stop()
+        if current_idx is not None:
+            progress.release(current_idx)
+        print(f"\n⛔ 轉錄已取消：已完成 {len(progress.records())}/{n_total} 段，進度保存在 → {progress.location}（重新執行即可續跑）")
+        raise
+    except InsufficientMemoryError as e:
+        if profiler is not None:
+            profiler.stop()
+        if current_idx is not None:
+            progress.release(current_idx)
+        print(f"\n⛔ 記憶體不足，停止轉錄：{e}\n已完成 {len(progress.records())}/{n_total} 段，進度保存在 → {progress.location}（釋放記憶體後重新執行即可續跑）")
+        raise
+
+    # 多個 worker 共用工作庫時，由最後完成段落的 worker 負責合併與寫檔
+    if not progress.finalize():
+        if profiler is not None:
+            profiler.stop()
+        print(f"其餘段落由其他 worker 處理中（尚有 {progress.pending_count()} 段），將由最後完成的 worker 合併輸出")
+        return
+
+    # 合併所有段落並處理重疊去重（按 index 排序）
+    records = progress.records()
+    results_ordered = [(i, rec["text"], rec.get("device", "unknown")) for i, rec in sorted(records.items())]
     merged_text = ""
-    for i, txt, used_dev in results_ordered:
-        if not merged_text:
-            merged_text = txt
+    with _stage("merge"):
+        if channels is not None:
+            # 各聲道各自去除重疊，依段落時間交錯
+            merger = ChannelMerger()
+            blocks = (merger.add(records[i].get("channels", [])) for i, _, _ in results_ordered)
+            merged_text = "\n\n".join(block for block in blocks if block)
         else:
-            merged_text = merge_two_segments(merged_text, txt)
+            for i, txt, used_dev in results_ordered:
+                if not merged_text:
+                    merged_text = txt
+                else:
+                    merged_text = merge_two_segments(merged_text, txt)
+    if profiler is not None:
+        profiler.stop()
 
     # 最終寫檔（包含 metadata header）
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
@@ -373,10 +2571,13 @@ def main(input_audio, output_text, non_interactive=False, auto_clean_progress=Fa
         f"**轉錄時間：** {timestamp}",
         f"**音檔來源：** {input_audio}",
         f"**分段數量：** {len(slice_list)}",
-        f"**分段長度（秒）：** {CHUNK_SECONDS}",
-        f"**重疊（秒）：** {OVERLAP_SECONDS}",
+        f"**分段方式：** {'靜音對齊' if segmentation == 'silence' else '固定長度'}",
+        f"**分段長度（秒）：** {chunk_seconds:g}",
+        f"**重疊（秒）：** {overlap_seconds:g}",
+        *([f"**聲道：** 分開轉錄（{channels.shape[0]} 聲道，依段落時間交錯）"] if channels is not None else []),
         f"**使用模型：** Breeze-ASR-25",
         f"**使用裝置（優先）：** {str(device).upper()}",
+        f"**推論精度：** {engine.dtype_name}",
         f"**總耗時：** {total_hms}（{total_elapsed:.1f} 秒）",
         "---\n"
     ]
@@ -390,11 +2591,15 @@ def main(input_audio, output_text, non_interactive=False, auto_clean_progress=Fa
         out_f.write("\n".join(header) + "\n")
         out_f.write(merged_text)
 
+    progress.finish()
+    if encoder_cache is not None:
+        print(f"ⓘ encoder 輸出快取：本次命中 {encoder_cache.hits - cache_hits} 段、新增 {encoder_cache.misses - cache_misses} 段")
     print(f"已儲存最終結果 → {output_text}")
-    print(f"進度檔保存在 → {prog_path}")
+    print(f"進度保存在 → {progress.location}")
 
-    # 非互動模式或旗標控制：是否刪除進度檔
-    if os.path.exists(prog_path):
+    # 非互動模式或旗標控制：是否刪除進度檔（工作庫中的紀錄則保留，供彙總查詢）
+    prog_path = progress.location
+    if store is None and os.path.exists(prog_path):
         if non_interactive:
             if auto_clean_progress:
                 try:
@@ -414,20 +2619,111 @@ def main(input_audio, output_text, non_interactive=False, auto_clean_progress=Fa
     print("\n✅ 完成")
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "store-stats":
+        stats_parser = argparse.ArgumentParser(prog="transcribe.py store-stats", description="彙總 SQLite 工作庫內所有工作的進度與吞吐量")
+        stats_parser.add_argument("store", help="工作庫路徑（即 --store 指定的檔案）")
+        stats_args = stats_parser.parse_args(sys.argv[2:])
+        if not os.path.exists(os.path.expanduser(stats_args.store)):
+            print(f"錯誤：找不到 {stats_args.store}")
+            sys.exit(1)
+        JobStore(stats_args.store).print_stats()
+        sys.exit(0)
+    if len(sys.argv) > 1 and sys.argv[1] == "autotune":
+        tune_parser = argparse.ArgumentParser(prog="transcribe.py autotune", description="量測本機各組分段、批次、執行緒設定的速度，最佳組合寫入本機設定檔供之後自動套用")
+        tune_parser.add_argument("--audio", type=str, default=None, help="量測用音檔（建議用一段實際錄音；預設為合成音訊）")
+        tune_parser.add_argument("--seconds", type=float, default=AUTOTUNE_CLIP_SECONDS, help=f"量測的音訊長度（秒，預設 {AUTOTUNE_CLIP_SECONDS}）")
+        tune_parser.add_argument("--language", type=str, default=None, help="量測時固定的語言（例如 zh）")
+        tune_parser.add_argument("--backend", choices=BACKENDS, default="torch", help="推論後端（預設 torch）")
+        tune_parser.add_argument("--dtype", choices=list(DTYPES), default="fp32", help="權重精度（預設 fp32）")
+        tune_parser.add_argument("--output", type=str, default=None, help=f"設定檔路徑（預設 {host_profile_path()}）")
+        tune_args = tune_parser.parse_args(sys.argv[2:])
+        autotune(tune_args.audio, clip_seconds=tune_args.seconds, backend=tune_args.backend, dtype=tune_args.dtype, language=tune_args.language, output_path=tune_args.output)
+        sys.exit(0)
+
     parser = argparse.ArgumentParser(description="Breeze-ASR-25 逐字稿（30s chunk + 3s overlap, 流式切片）")
-    parser.add_argument("input_audio", help="輸入音檔路徑")
-    parser.add_argument("output_text", help="輸出文字檔路徑")
+    parser.add_argument("input_audio", help="輸入音檔路徑（若為資料夾，則以跨檔案批次轉錄其中所有音檔）")
+    parser.add_argument("output_text", help="輸出文字檔路徑（輸入為資料夾時為輸出資料夾）")
     parser.add_argument("--non-interactive", action="store_true", help="非互動模式（不使用 input 提示）")
     parser.add_argument("--auto-clean-progress", action="store_true", help="非互動模式下自動刪除進度檔")
     parser.add_argument("--language", type=str, default=None, help="強制指定語言（例如 zh、en）；預設自動偵測")
+    parser.add_argument("--per-chunk-language", action="store_true", help="未指定 --language 時改為每段各自偵測語言（預設整個檔案偵測一次）")
     parser.add_argument("--suppress-warnings", action="store_true", help="抑制第三方套件的常見警告訊息（torchaudio/transformers）")
+    parser.add_argument("--redecode-truncated", action="store_true", help="續跑時以取樣重新解碼先前因重複迴圈被截斷的段落")
+    parser.add_argument("--second-pass", action="store_true", help=f"第二階段解碼：平均 log 機率低於 {LOGPROB_THRESHOLD}、壓縮比高於 {COMPRESSION_RATIO_THRESHOLD} 或被截斷的段落，再以 beam search / 取樣重新解碼")
+    parser.add_argument("--batch-size", type=int, default=None, help=f"資料夾模式：每次 generate 的目標段落數（預設依本機調校設定，否則 {BATCH_SIZE}）")
+    parser.add_argument("--max-batch-wait", type=float, default=MAX_BATCH_WAIT, help=f"資料夾模式：最久等待湊批秒數（預設 {MAX_BATCH_WAIT}）")
+    parser.add_argument("--max-jobs", type=int, default=None, help="資料夾模式：同時處理的檔案數（預設為 batch size 的兩倍）")
+    parser.add_argument("--update-model", action="store_true", help="連網檢查並下載模型更新（預設模型已在本機時完全不連網）")
+    parser.add_argument("--verify-model", action="store_true", help="載入前比對本機模型檔的 SHA-256")
+    parser.add_argument("--model-cache-dir", metavar="DIR", default=None, help="HF 模型快取目錄（預設為 HF 預設位置；模型已在此目錄時完全不連網）")
+    parser.add_argument("--model-manifest", metavar="PATH", default=None, help="模型清單路徑（預設依 --model-cache-dir 決定）")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="推論後端：torch（預設）或 onnx（ONNX Runtime，CPU；首次會匯出並快取模型）")
+    parser.add_argument("--compare-backends", type=int, metavar="N", default=None, help="以輸入音檔前 N 段比較 torch 與 onnx 後端的一致性與速度後結束")
+    parser.add_argument("--min-similarity", type=float, default=PARITY_MIN_SIMILARITY, metavar="RATIO",
+                        help=f"--compare-backends / --dtype-parity 的文字一致性門檻（0~1，預設 {PARITY_MIN_SIMILARITY}）；未達門檻時以狀態碼 1 結束")
+    parser.add_argument("--dtype", choices=list(DTYPES), default="fp32", help="權重精度：fp32（預設）、bf16、fp16；裝置不支援時自動退回 fp32")
+    parser.add_argument("--dtype-parity", type=int, metavar="N", default=None, help="以輸入音檔前 N 段比較 --dtype 與 fp32 的輸出一致性與速度後結束")
+    parser.add_argument("--segmentation", choices=SEGMENTATION_MODES, default=None, help=f"分段方式：fixed（{CHUNK_SECONDS}s + {OVERLAP_SECONDS}s 重疊）或 silence（切點對齊靜音處，重疊 {SNAP_OVERLAP_SECONDS}s）；預設依本機調校設定（續跑時沿用進度檔的設定），否則 fixed")
+    parser.add_argument("--split-channels", action="store_true", help="多聲道錄音各聲道分開轉錄（同一段的各聲道批次推論），輸出依時間交錯並標上 [聲道N]")
+    parser.add_argument("--encoder-cache", type=float, nargs="?", const=ENCODER_CACHE_MAX_MB, default=None, metavar="MB",
+                        help=f"啟用磁碟 encoder 輸出快取（{ENCODER_CACHE_DIR}，上限預設 {ENCODER_CACHE_MAX_MB}MB）：同一音檔改用其他語言或解碼設定重跑時只需執行 decoder")
+    parser.add_argument("--threads", type=int, default=None, help="PyTorch CPU 執行緒數（預設依本機調校設定，否則為 PyTorch 預設）")
+    parser.add_argument("--stream", action="store_true", help="逐 token 即時顯示目前段落的部分文字，段落完成後顯示最終文字")
+    parser.add_argument("--profile", action="store_true", help=f"效能分析：於輸出檔旁寫出 Chrome trace（{PROFILE_TRACE_SUFFIX}）與 cProfile 統計（{PROFILE_STATS_SUFFIX}）")
+    parser.add_argument("--profile-chunks", type=str, default="1", help="效能分析的段落範圍（1-based，例如 3 或 2-5；預設 1）")
+    parser.add_argument("--store", type=str, default=None, metavar="PATH", help="進度改存於 SQLite 工作庫（可多個程序同時處理同一檔案或資料夾；首次使用時匯入既有 JSON 進度檔）")
     args = parser.parse_args()
+    store = JobStore(args.store) if args.store else None
 
-    main(
-        args.input_audio,
-        args.output_text,
-        non_interactive=args.non_interactive,
-        auto_clean_progress=args.auto_clean_progress,
-        language=args.language,
-        suppress_warnings=args.suppress_warnings,
-    )
\ No newline at end of file
+    if args.compare_backends:
+        results = compare_backends(args.input_audio, n_chunks=args.compare_backends, language=args.language, min_similarity=args.min_similarity)
+        sys.exit(0 if all(r["passed"] for r in results.values()) else 1)
+    elif args.dtype_parity:
+        results = check_dtype_parity(args.input_audio, args.dtype, n_chunks=args.dtype_parity, language=args.language, min_similarity=args.min_similarity)
+        sys.exit(0 if all(r["passed"] for r in results.values()) else 1)
+    elif os.path.isdir(os.path.expanduser(args.input_audio)):
+        input_dir = os.path.expanduser(args.input_audio)
+        output_dir = os.path.expanduser(args.output_text)
+        jobs = _collect_audio_jobs(input_dir, output_dir)
+        if not jobs:
+            print(f"錯誤：{input_dir} 內沒有音檔")
+        else:
+            print(f"資料夾模式：共 {len(jobs)} 個音檔")
+            transcribe_files_batched(
+                jobs,
+                engine=TranscriptionEngine(backend=args.backend, dtype=args.dtype, update_model=args.update_model, verify_model=args.verify_model, encoder_cache_mb=args.encoder_cache,
+                                          model_cache_dir=args.model_cache_dir, manifest_path=args.model_manifest),
+                batch_size=args.batch_size,
+                max_wait=args.max_batch_wait,
+                max_jobs=args.max_jobs,
+                auto_clean_progress=args.auto_clean_progress,
+                language=args.language,
+                suppress_warnings=args.suppress_warnings,
+                detect_file_language=not args.per_chunk_language,
+                segmentation=args.segmentation,
+                store=store,
+                num_threads=args.threads,
+                split_channels=args.split_channels,
+                second_pass=args.second_pass,
+            )
+    else:
+        main(
+            args.input_audio,
+            args.output_text,
+            non_interactive=args.non_interactive,
+            auto_clean_progress=args.auto_clean_progress,
+            language=args.language,
+            suppress_warnings=args.suppress_warnings,
+            redecode_truncated=args.redecode_truncated,
+            engine=TranscriptionEngine(backend=args.backend, dtype=args.dtype, update_model=args.update_model, verify_model=args.verify_model, encoder_cache_mb=args.encoder_cache,
+                                          model_cache_dir=args.model_cache_dir, manifest_path=args.model_manifest),
+            profile=args.profile,
+            profile_chunks=parse_chunk_range(args.profile_chunks),
+            stream_callback=_cli_stream_printer() if args.stream else None,
+            detect_file_language=not args.per_chunk_language,
+            segmentation=args.segmentation,
+            store=store,
+            num_threads=args.threads,
+            split_channels=args.split_channels,
+            second_pass=args.second_pass,
+        )
\ No newline at end of file